@@ -4,6 +4,9 @@ from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestRegressor
 import joblib
 import json
+import datetime
+import time
+import os
 
 # model predicts [5%,] growth at [50, ] days 
 class AI:
@@ -14,6 +17,25 @@ class AI:
 	modelFile = None
 	modelInfo = {}
 	activeModel = None
+	features = None
+	# pairs of days closer than this are not used
+	minDaysDiff = 50
+	# rows of the history unpacked at once
+	chunkSize = 1000000
+	# the model file is an artifact of the model, its feature schema and training metadata,
+	# the version changes with the artifact layout or the meaning of the features
+	schemaVersion = 1
+	# incremental updates add trees built on the pairs new to the model, it is trained again from scratch
+	# when the last full training is fullTrainingDays old, the forest would exceed maxTrees,
+	# or the error on new pairs exceeds the test error of the full training by maxDrift
+	updateTrees = 10
+	maxTrees = 200
+	fullTrainingDays = 7
+	maxDrift = 0.05
+	# days (ordinals) whose pairs the model is trained on, and days which are final in the history file
+	trainedDays = None
+	historyDays = None
+	historyIndicators = None
 
 	def create(historyFile, historySampleSize = None, modelFile = 'ai_model.joblib'):
 		ai = AI()
@@ -23,75 +45,224 @@ class AI:
 		ai.activeModel = ai._trainModel()
 		return ai
 
-	def load(historyFile, modelFile = 'ai_model.joblib'):
+	def update(historyFile, historySampleSize = None, modelFile = 'ai_model.joblib', full = False):
+		ai = AI.load(historyFile, modelFile)
+		ai.sampleSize = historySampleSize
+		reason = 'requested' if full else ai._checkModel()
+		if reason is None:
+			reason = ai._updateModel()
+		if reason is not None:
+			ai.historyData = None
+			ai.activeModel = ai._trainModel(reason)
+		return ai
+
+	def load(historyFile = None, modelFile = 'ai_model.joblib'):
+		# the model is read on first use, historyFile is only needed for models saved without a schema
 		ai = AI()
 		ai.historyFile = historyFile
 		ai.modelFile = modelFile
-		ai.activeModel = joblib.load(ai.modelFile)
 		return ai
 
+	def _getModel(self):
+		if self.activeModel is None:
+			# the whole forest is read into memory, trees copy their nodes into buffers of their own when unpickled
+			artifact = joblib.load(self.modelFile)
+			if not isinstance(artifact, dict):
+				self.activeModel = artifact
+			elif artifact['schema']['version'] != AI.schemaVersion:
+				raise Exception(f"model schema version {artifact['schema']['version']} is not {AI.schemaVersion}, the model is to be trained again")
+			else:
+				self.activeModel = artifact['model']
+				self.features = artifact['schema']['features']
+				self.modelInfo = artifact['info']
+				self.trainedDays = artifact.get('days')
+		return self.activeModel
+
+	def _saveModel(self, model, features, timings):
+		artifact = {
+			'schema': {'version': AI.schemaVersion, 'features': features, 'encoding': 'uint8, 1 when the indicator is present'},
+			'model': model,
+			'info': self.modelInfo,
+			'days': self.trainedDays
+		}
+		# replaced at once, so a model being trained never breaks a running export
+		started = time.time()
+		joblib.dump(artifact, self.modelFile + '.tmp')
+		os.replace(self.modelFile + '.tmp', self.modelFile)
+		# known only once the artifact is written, it is in the info printed after saving
+		timings['store'] = round(time.time() - started, 2)
+
 	def printModelInfo(self):
+		self._getModel()
 		print(json.dumps(self.modelInfo, indent=4))
 		print(json.dumps(self._getFeaturesImportance(), indent=4))
 
 	def getPrediction(self, features:dict):
-		data = []
-		for feature in self._getFeatures():
-			if feature in features:
-				data.append(1 if features[feature] else 0)
-		return self.activeModel.predict([data])[0]
+		names = list(features.keys())
+		return self.predict_batch([[1 if features[name] else 0 for name in names]], names, None)[0]
+
+	def predict_batch(self, matrix, features:list, n_jobs = -1):
+		# predictions of all rows in one call, columns of the matrix are named by features
+		# and put in the order the model was trained with, trees are evaluated by n_jobs cores
+		model = self._getModel()
+		names = self._getFeatures()
+		missing = [name for name in names if name not in features]
+		if missing:
+			raise Exception(f'features of the model are not given: {missing}')
+		data = np.asarray(matrix, dtype=np.uint8).reshape(-1, len(features))[:, [features.index(name) for name in names]]
+		if not len(data):
+			return np.zeros(0)
+		if hasattr(model, 'feature_names_in_'):
+			data = pandas.DataFrame(data, columns=names)
+		model.set_params(n_jobs=n_jobs)
+		return model.predict(data)
 
 	def _getFeaturesImportance(self):
-		importances = list(self.activeModel.feature_importances_)
+		importances = list(self._getModel().feature_importances_)
 		feature_importances = [(feature, round(importance, 2)) for feature, importance in zip(self._getFeatures(), importances)]
 		feature_importances = sorted(feature_importances, key = lambda x: x[1], reverse = True)
 		return {pair[0]:pair[1] for pair in feature_importances}
 
-	def _loadHistory(self):
+	def _loadHistory(self, trainedDays = None):
+		# pairs of days built by analyzer History: indicators of the earlier day as a bitmask, days between and growth,
+		# bitmasks of the used (and sampled) rows only are unpacked by chunks into uint8 columns,
+		# pairs of a day which may still change wait for it to be final, with trainedDays only the pairs new to the model
 		if self.historyData is None:
-			self.historyData = pandas.read_csv(self.historyFile).query('days_diff >= 50')
+			history = np.load(self.historyFile)
+			self.historyDays = history['dates'].tolist()
+			self.historyIndicators = AI._getIndicators(history)
+			earlier = history['day'] - history['days_diff']
+			used = history['days_diff'] >= AI.minDaysDiff
+			used &= np.isin(history['day'], history['dates']) & np.isin(earlier, history['dates'])
+			if trainedDays is not None:
+				used &= ~(np.isin(history['day'], trainedDays) & np.isin(earlier, trainedDays))
+			rows = np.flatnonzero(used)
+			if self.sampleSize and self.sampleSize < len(rows):
+				rows = np.sort(np.random.default_rng().choice(rows, self.sampleSize, replace=False))
+			treats = history['treats'].tolist()
+			masks = history['masks']
+			bits = np.arange(len(treats), dtype=np.uint32)
+			features = np.empty((len(rows), len(treats)), dtype=np.uint8)
+			for start in range(0, len(rows), AI.chunkSize):
+				chunk = masks[rows[start:start + AI.chunkSize]]
+				features[start:start + len(chunk)] = (chunk[:, None] >> bits) & 1
+			self.historyData = (pandas.DataFrame(features, columns=treats, copy=False), history['growth_percent'][rows])
 		return self.historyData
 
+	def _getIndicators(history):
+		# hash of the indicator declarations the history is built with
+		return str(history['indicators']) if 'indicators' in history.files else None
+
 	def _getFeatures(self):
-		return list(self._loadHistory().columns)
-
-	def _trainModel(self):
-		features = self._loadHistory().sample(n=self.sampleSize) if self.sampleSize else self._loadHistory()
-		features['has_growth'] = [1 if growth>5 else 0 for growth in features['growth_percent']]
-		labels = np.array(features['has_growth'])
-		features = features.drop(['has_growth', 'growth_percent', 'days_diff'], axis = 1)
-		features = np.array(features)
+		# features in training order from the schema, models saved without it fall back to the history file
+		model = self._getModel()
+		if self.features is not None:
+			return self.features
+		if hasattr(model, 'feature_names_in_'):
+			return list(model.feature_names_in_)
+		return np.load(self.historyFile)['treats'].tolist()
+
+	def _checkModel(self):
+		# why the model is to be trained from scratch, None when it can be updated
+		if not os.path.exists(self.modelFile):
+			return 'no model'
+		try:
+			model = self._getModel()
+		except Exception as e:
+			return str(e)
+		if self.trainedDays is None:
+			return 'no trained days in the model'
+		history = np.load(self.historyFile)
+		if self.modelInfo['history']['min_days_diff'] != AI.minDaysDiff or history['treats'].tolist() != self._getFeatures():
+			return 'features or pairs of the history changed'
+		if self.modelInfo['history'].get('indicators') != AI._getIndicators(history):
+			return 'indicators of the history are declared otherwise'
+		if datetime.datetime.now() - datetime.datetime.fromisoformat(self.modelInfo['created']) >= datetime.timedelta(days=AI.fullTrainingDays):
+			return f'last full training is {AI.fullTrainingDays} days old'
+		if len(model.estimators_) + AI.updateTrees > AI.maxTrees:
+			return f'forest would exceed {AI.maxTrees} trees'
+		return None
+
+	def _updateModel(self):
+		# trees built on the new pairs only are added to the forest, returns why the model is to be trained
+		# from scratch when it has drifted, a model without new pairs is kept as it is
+		timings = {}
+		started = time.time()
+		model = self.activeModel
+		features, growth = self._loadHistory(self.trainedDays)
+		labels = (growth > 5).astype(np.uint8)
+		timings['load'] = round(time.time() - started, 2)
+		if not len(features):
+			return None
+		# drift: error of the model on pairs it has never seen against its error on the test pairs of the full training
+		started = time.time()
+		model.set_params(n_jobs = -1)
+		error = float(np.mean((model.predict(features) - labels) ** 2))
+		drift = round(error - self.modelInfo['error'], 4)
+		timings['drift'] = round(time.time() - started, 2)
+		if drift > AI.maxDrift:
+			return f'drift {drift} exceeds {AI.maxDrift}'
+		started = time.time()
+		model.set_params(warm_start = True, n_estimators = len(model.estimators_) + AI.updateTrees).fit(features, labels)
+		model.set_params(warm_start = False)
+		timings['fit'] = round(time.time() - started, 2)
+		self.trainedDays = self.historyDays
+		self.modelInfo['updates'].append({
+			'created': datetime.datetime.now().isoformat(timespec='seconds'),
+			'pairs': len(features),
+			'trees': len(model.estimators_),
+			'error': round(error, 4),
+			'drift': drift,
+			'timings': timings
+		})
+		self._saveModel(model, self.features, timings)
+		return None
+
+	def _trainModel(self, reason = 'requested'):
+		timings = {}
+		started = time.time()
+		features, growth = self._loadHistory()
+		labels = (growth > 5).astype(np.uint8)
+		timings['load'] = round(time.time() - started, 2)
+		started = time.time()
+		# fitted on named columns, so the model knows its feature order, trees are built on all cores
 		train_features, test_features, train_labels, test_labels = train_test_split(features, labels, test_size = 0.2, random_state = 1337)
-		model = RandomForestRegressor(n_estimators = 100, max_depth=15, min_samples_leaf=1,random_state = 1337).fit(train_features, train_labels)
-		# store
-		joblib.dump(model, self.modelFile)
+		model = RandomForestRegressor(n_estimators = 100, max_depth=15, min_samples_leaf=1,random_state = 1337, n_jobs = -1).fit(train_features, train_labels)
+		timings['fit'] = round(time.time() - started, 2)
 		# evaluate
+		started = time.time()
 		predictions = model.predict(test_features)
 		bar = 0.5
 		percentiles = [[0.05, 0.95], [0.1, 0.9], [0.15, 0.85], [0.2, 0.8], [bar, bar]]
 		self.modelInfo = {
+			'created': datetime.datetime.now().isoformat(timespec='seconds'),
+			'history': {
+				'file': self.historyFile,
+				'min_days_diff': AI.minDaysDiff,
+				'indicators': self.historyIndicators,
+				'sample': self.sampleSize,
+			},
 			'features':{
 				'total': len(features),
 				'train': len(train_features),
 				'test': len(test_features),
 			},
-			'training': {}
+			'training': {},
+			# mean squared error on the test pairs, the base of the drift of updates
+			'error': round(float(np.mean((predictions - test_labels) ** 2)), 4),
+			'reason': reason,
+			'updates': []
 		}
 		for percentile in percentiles:
-			hits_growth, actual_growth, hits_fall, actual_fall, total = 0, 0, 0, 0, 0
-			for i in range(0, len(predictions)):
-				# pass out of percentile values
-				if percentile[0]<=predictions[i]<=percentile[1]:
-					continue
-				# collect growth predictions
-				if test_labels[i]==1:
-					hits_growth += 1 if predictions[i]>bar else 0
-					actual_growth += 1
-				# collect fall predictions
-				if test_labels[i]==0:
-					hits_fall += 1 if predictions[i]<bar else 0
-					actual_fall += 1
-				total += 1
+			# pass out of percentile values
+			counted = (predictions < percentile[0]) | (predictions > percentile[1])
+			growing = counted & (test_labels == 1)
+			falling = counted & (test_labels == 0)
+			hits_growth = int(np.count_nonzero(growing & (predictions > bar)))
+			actual_growth = int(np.count_nonzero(growing))
+			hits_fall = int(np.count_nonzero(falling & (predictions < bar)))
+			actual_fall = int(np.count_nonzero(falling))
+			total = int(np.count_nonzero(counted))
 			self.modelInfo['training'][str(int(percentile[0]*100))] = {
 				'growth': round(hits_growth/actual_growth, 4),
 				'fall': round(hits_fall/actual_fall, 4),
@@ -99,8 +270,14 @@ class AI:
 				'hits_fall': hits_fall,
 				'total': total
 			}
+		timings['evaluate'] = round(time.time() - started, 2)
+		# store
+		self.features = list(features.columns)
+		self.trainedDays = self.historyDays
+		self.modelInfo['timings'] = timings
+		self._saveModel(model, self.features, timings)
 		return model
 
 if __name__ == '__main__':
-	ai = AI.create(historyFile='history.csv', historySampleSize=700000, modelFile = 'ai_model.tmp.joblib')
+	ai = AI.create(historyFile='history.npz', historySampleSize=700000, modelFile = 'ai_model.tmp.joblib')
 	ai.printModelInfo()
\ No newline at end of file
@@ -4,9 +4,13 @@ import pymongo
 import datetime
 import math
 import argparse
-import csv
 import json
+import hashlib
+import time
+import os
+import numpy
 import ai
+import snapshot
 
 class Storage:
 	def __init__(self, date):
@@ -18,369 +22,545 @@ class Storage:
 		else:
 			raise Exception('collection not exists')
 
-	def select(self, query, aggregate=False):
-		data = self.collection.find(query) if not aggregate else self.collection.aggregate(query)
-		return list(data)
+	def select(self, query, aggregate=False, projection=None):
+		# lazy cursor: documents are streamed by batches, with the projected fields only
+		if aggregate:
+			return self.collection.aggregate(query + [{'$project': projection}] if projection else query)
+		return self.collection.find(query, projection)
 
 	def getTicker(self, ticker):
 		return self.collection.find_one({'ticker': ticker})
 
+	def getSnapshot(self, fields, listFields, valueFields):
+		documents = self.select({}, False, Indicators._projection(set(fields) | set(listFields) | set(valueFields)))
+		return snapshot.Snapshot.fromDocuments(documents, fields, listFields, valueFields)
 
-class Indicators():
 
-	def __init__(self, date):
-		self.date = date
-		self.selector = Storage(date)
-
-	# treat
-	def getHoldersInLoss(self):
-		return self.selector.select(
-			{
-				'holders.profitableSharesRatio':{'$exists':True, '$lte':0.5}, 
-				'holders.avgCostToCurrentRatio':{'$exists':True, '$gt':1.05}
-			}
-		)
-
-	# treat: no fall bets
-	def getOptionsPositive(self):
-		return self.selector.select(
-			{
-				'$and': [
-					{'options': {'$exists':True}},
-					{'options': {'$not': {'$elemMatch':{'direction': 'down'}}}},
-					{'options': {'$not': {'$elemMatch':{'expectedCostToCurrentRatio':{'$lt': 1}}}}}
-				]
-			}
-		)
-
-	# treat
-	def getAnalyticsRecommendBuy(self):
-		return self.selector.select(
-			{
-				'anal.buyCountRatio':{'$exists':True, '$gte':0.7}, 
-				'anal.buyCount':{'$exists':True, '$gte':5}, 
-				'anal.sellCount':{'$exists':True, '$eq':0},
-				'anal.targetCostToCurrentRatio':{'$exists':True, '$gt':1}, 
-			}
-		)
-
-	# treat
-	def getSocialAttitudeGood(self):
-		return self.selector.select(
-			{
-				'social_guess.overall.bullRatio':{'$exists':True, '$gt':0.7}, 
-				'social_guess.overall.bulls':{'$exists':True, '$gt':20},
-				'heldSharesRatio':{'$gte':0.7}
-			}
-		)
-
-	# treat: current cost should be better
-	def getCostBelowFareCost(self):
-		return self.selector.select(
-			{
-				# growing trend during 1 year and 5 years
-				'trend.costTrend1Y':{'$exists':True, '$gt':0}, 
-				'trend.costTrend5Y':{'$exists':True, '$gt':0},
-				# fare cost is below trend for 1 year and 5 years
-				'trend.currentCostToFareTrend1YRatio':{'$exists':True, '$lt':0.97}, 
-				'trend.currentCostToFareTrend5YRatio':{'$exists':True, '$lt':0.97}
-			}
-		)
-
-	# treat
-	def getStableGrowing(self):
-		return self.selector.select(
-			{
-				'trend.costTrend5Y':{'$exists':True, '$gt':0},
-				'trend.costTrend1Y':{'$exists':True, '$gt':0}
-			}
-		)
-
-	# treat
-	def getTechnicallyGood(self):
-		return self.selector.select(
-			{
-				'pe': {'$exists':True, '$lte': 30, '$gte': 0},
-				'eps':{'$exists':True, '$gte':0},
-			}
-		)	
-
-	# treat
-	def getTechnicalAnalysisGood(self):
-		return self.selector.select(
-			{
-				'technical.ta.day.oscillators':{'$exists':True, '$gte': 0},
-				'technical.ta.day.summary':{'$exists':True, '$gte': 0},
-				'technical.ta.day.ma':{'$exists':True, '$gte': 0},
-				'technical.ta.week.oscillators':{'$exists':True, '$gte': 0},
-				'technical.ta.week.summary':{'$exists':True, '$gte': 0},
-				'technical.ta.week.ma':{'$exists':True, '$gte': 0},
-			}
-		)		
-
-	# treat: cost trend worse than revenue trend
-	def getDevelopingUnderestimated(self):
-		return self.selector.select(
-			[
-				{
-					'$addFields':{
-						'trend_farness_5Y':{'$subtract':['$income.revenueTrend', '$trend.costTrend5Y']},
-						'trend_farness_1Y':{'$subtract':['$income.revenueTrendLatest', '$trend.costTrend1Y']}
-					}
-				},
-				{
-					'$match':{
-						'income.revenueTrend':{'$exists':True, '$gt':0}, 
-						'trend_farness_5Y':{'$gt':0}, 
-						'trend_farness_1Y':{'$gt':0}
-						}
-					}
-			], 
-			True
-		)
-
-	# treat: market occupation increasing because revenue growing from year to year and it keep going
-	def getOccupationGrowing(self):
-		return self.selector.select(
-			{
-				'income.revenueTrend':{'$exists':True, '$gt':0.1},
-				'income.revenueTrendLatest':{'$exists':True, '$gt':0}
-			}
-		)
-
-	# treat: company has excessive money after all operating expenses
-	def getProfitable(self):
-		return self.selector.select(
-			{
-				'income.netIncome':{'$exists':True, '$gt':0}
-			}
-		)
-
-	# treat: good managed because more and more money settles on company`s balance
-	def getOperatingEffective(self):
-		return self.selector.select(
-			{
-				'income.operatingIncomeYoyTrend':{'$exists':True, '$gt':0},
-				'income.operatingIncome':{'$exists':True, '$gt':0}
-			}
-		)
-
-	# treat: company taking more and more every year
-	def getAggressor(self):
-		return self.selector.select(
-			{
-				# latest year trend up
-				'income.operatingIncomeYoyTrendLatest':{'$exists':True, '$gt':0},
-				'income.revenueYoyTrendLatest':{'$exists':True, '$gt':0},
-				# overall trend up
-				'income.operatingIncomeYoyTrend':{'$exists':True, '$gt':0},
-				'income.revenueYoyTrend':{'$exists':True, '$gt':0}
-			}
-		)
-
-	# treat: company`s revenue serged to heaven
-	def getOccupationGrowthBegan(self):
-		return self.selector.select(
-			{
-				'$expr': {'$gt': ['$income.revenueYoyTrendLatest', '$income.revenueYoyTrend']},
-				'income.revenueYoyTrendLatest': {'$exists':True, '$gt':0}
-			}
-		)
-
-	# treat: possible short squeeze
-	def getTightShorts(self):
-		return self.selector.select(
-			{
-				'short.daysToCover':{'$exists':True, '$gte':3.5}
-			}
-		)
+class SnapshotFiles:
+	# days exported by the crawler as Arrow files (see snapshot.py), read memory-mapped without Mongo
+	directory = None
 
-	# treat: soon growth
-	def getResistance5dayBreakout(self):
-		return self.selector.select(
-			{
-				'technical.breakout_magnitude':{'$exists':True}
-			}
-		)
-
-	# treat: insiders know something
-	def getInsiderBuying(self):
-		return self.selector.select(
-			{
-				'insiders.purchasedPrice':{'$exists':True}
-			}
-		)
+	def __init__(self, date):
+		self.filename = os.path.join(SnapshotFiles.directory, date.strftime('tickers_%Y_%m_%d.arrow'))
+		if not os.path.exists(self.filename):
+			raise Exception('snapshot not exists')
+
+	def getSnapshot(self, fields, listFields, valueFields):
+		return snapshot.load(self.filename, fields, listFields, valueFields)
+
+
+class IndicatorCompiler:
+
+	# An indicator is declared as a list of conditions which all hold. A condition is {'all': [...]}, {'any': [...]},
+	# or tests of one value: {'field': path} or {'subtract': [path, path]} with any of
+	#   'exists': bool, 'eq'/'gt'/'gte'/'lt'/'lte': literal, 'in': [literals],
+	#   'gtField': path (expression order, so a missing or null path is below any number),
+	#   'daysAhead': days (a date after the day of data and no later than days after it),
+	#   'noElement': condition, which no document in the array at the path satisfies.
+	# Comparisons have the query semantics: they match values of the literal's type only.
+	# Declarations compile to a Mongo filter per indicator, to aggregation expressions and to NumPy over a Snapshot.
+
+	def _conditions(condition):
+		if isinstance(condition, list):
+			return 'all', condition
+		for combinator in ('all', 'any'):
+			if combinator in condition:
+				return combinator, condition[combinator]
+		return None, None
+
+	def _dateRange(date, days):
+		return date, date + datetime.timedelta(days=days)
+
+	def fields(condition, listFields = None):
+		# scalar paths the condition reads and, for noElement, the paths read inside array elements
+		listFields = {} if listFields is None else listFields
+		combinator, conditions = IndicatorCompiler._conditions(condition)
+		if combinator:
+			fields = set()
+			for item in conditions:
+				fields |= IndicatorCompiler.fields(item, listFields)[0]
+			return fields, listFields
+		fields = set(condition['subtract']) if 'subtract' in condition else set()
+		if 'gtField' in condition:
+			fields.add(condition['gtField'])
+		if 'noElement' in condition:
+			elementFields = IndicatorCompiler.fields(condition['noElement'])[0]
+			listFields[condition['field']] = listFields.get(condition['field'], set()) | elementFields
+		elif 'field' in condition:
+			fields.add(condition['field'])
+		return fields, listFields
+
+	def toQuery(condition, date):
+		# Mongo filter, or $addFields/$match pipeline when a derived value is compared
+		derived = {}
+		query = IndicatorCompiler._toFilter(condition, date, derived)
+		if derived:
+			return [{'$addFields': derived}, {'$match': query}], True
+		return query, False
+
+	def _toFilter(condition, date, derived):
+		combinator, conditions = IndicatorCompiler._conditions(condition)
+		if combinator:
+			return {'$and' if combinator == 'all' else '$or': [IndicatorCompiler._toFilter(item, date, derived) for item in conditions]}
+		if 'subtract' in condition:
+			path = f'_derived{len(derived)}'
+			derived[path] = {'$subtract': ['$' + field for field in condition['subtract']]}
+		else:
+			path = condition['field']
+		operators, clauses = {}, []
+		for test, argument in condition.items():
+			if test in ('exists', 'eq', 'gt', 'gte', 'lt', 'lte', 'in'):
+				operators['$' + test] = argument
+			elif test == 'daysAhead':
+				operators['$gt'], operators['$lte'] = IndicatorCompiler._dateRange(date, argument)
+			elif test == 'gtField':
+				clauses.append({'$expr': {'$gt': ['$' + path, '$' + argument]}})
+			elif test == 'noElement':
+				clauses.append({path: {'$not': {'$elemMatch': IndicatorCompiler._toFilter(argument, date, derived)}}})
+		if operators:
+			clauses.insert(0, {path: operators})
+		return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+	def toExpression(condition, date, prefix = '$'):
+		# aggregation expression of the condition, the query semantics are spelled out by type checks
+		combinator, conditions = IndicatorCompiler._conditions(condition)
+		if combinator:
+			return {'$and' if combinator == 'all' else '$or': [IndicatorCompiler.toExpression(item, date, prefix) for item in conditions]}
+		if 'subtract' in condition:
+			left, right = [prefix + field for field in condition['subtract']]
+			value = {'$cond': [{'$and': [{'$isNumber': left}, {'$isNumber': right}]}, {'$subtract': [left, right]}, None]}
+		else:
+			value = prefix + condition['field']
+		tests = []
+		for test, argument in condition.items():
+			if test == 'exists':
+				tests.append({'$ne' if argument else '$eq': [{'$type': value}, 'missing']})
+			elif test in ('eq', 'gt', 'gte', 'lt', 'lte'):
+				tests.append(IndicatorCompiler._typedComparison(value, test, argument))
+			elif test == 'in':
+				tests.append({'$or': [IndicatorCompiler._typedComparison(value, 'eq', literal) for literal in argument]})
+			elif test == 'daysAhead':
+				after, till = IndicatorCompiler._dateRange(date, argument)
+				tests += [IndicatorCompiler._typedComparison(value, 'gt', after), IndicatorCompiler._typedComparison(value, 'lte', till)]
+			elif test == 'gtField':
+				tests.append({'$gt': [value, prefix + argument]})
+			elif test == 'noElement':
+				element = {'$and': [{'$eq': [{'$type': '$$element'}, 'object']}, IndicatorCompiler.toExpression(argument, date, '$$element.')]}
+				tests.append({'$not': [{'$cond': [{'$isArray': value}, {'$anyElementTrue': [{'$map': {'input': value, 'as': 'element', 'in': element}}]}, False]}]})
+		return {'$and': tests}
+
+	def _typedComparison(value, operator, literal):
+		if literal is None:
+			return {'$in': [{'$type': value}, ['null', 'missing']]} if operator in ('eq', 'gte', 'lte') else False
+		if isinstance(literal, bool):
+			typeCheck = {'$eq': [{'$type': value}, 'bool']}
+		elif isinstance(literal, (int, float)):
+			typeCheck = {'$isNumber': value}
+		elif isinstance(literal, datetime.datetime):
+			typeCheck = {'$eq': [{'$type': value}, 'date']}
+		else:
+			typeCheck = {'$eq': [{'$type': value}, 'string']}
+		# NaN is below all numbers in expressions but matches no query comparison
+		return {'$and': [typeCheck, {'$ne': [value, float('nan')]}, {'$' + operator: [value, literal]}]}
+
+	def evaluate(condition, snapshot, date):
+		combinator, conditions = IndicatorCompiler._conditions(condition)
+		if combinator:
+			results = [IndicatorCompiler.evaluate(item, snapshot, date) for item in conditions]
+			if combinator == 'all':
+				return numpy.logical_and.reduce(results + [numpy.ones(len(snapshot), dtype=bool)])
+			return numpy.logical_or.reduce(results + [numpy.zeros(len(snapshot), dtype=bool)])
+		if 'subtract' in condition:
+			left, right = condition['subtract']
+			column = snapshot.column(left).subtract(snapshot.column(right))
+		else:
+			column = snapshot.column(condition['field'])
+		matches = numpy.ones(len(snapshot), dtype=bool)
+		for test, argument in condition.items():
+			if test == 'exists':
+				matches &= column.exists() == argument
+			elif test in ('eq', 'gt', 'gte', 'lt', 'lte'):
+				matches &= column.compare(test, argument)
+			elif test == 'in':
+				matches &= column.isIn(argument)
+			elif test == 'daysAhead':
+				after, till = IndicatorCompiler._dateRange(date, argument)
+				matches &= column.compare('gt', after) & column.compare('lte', till)
+			elif test == 'gtField':
+				matches &= column.order(snapshot.column(argument)) > 0
+			elif test == 'noElement':
+				elements = snapshot.list(condition['field'])
+				matches &= ~elements.any(IndicatorCompiler.evaluate(argument, elements.elements, date))
+		return matches
 
-	# treat: most investors bought recently
-	def getMoneyFlowIn(self):
-		return self.selector.select(
-			{
-				'flows.inflowToOutflowRatio':{'$exists':True, '$gt':1.1}
-			}
-		)
 
-	# treat
-	def getDividendsPaying(self):
-		return self.selector.select(
-			{
-				'dividend.has':True
-			}
-		)
+class Indicators():
 
-	# treat
-	def getDividendsSoon(self):
-		return self.selector.select(
-			{
-				'dividend.upcoming.date':{"$gt": self.date, "$lte": self.date+datetime.timedelta(days=30)}
-			}
-		)
-
-	# treat: blowing from every corner
-	def getHyped(self):
-		return self.selector.select(
-			{
-				'$or':[
-					{'social_guess.wsb':{'$exists':True}},
-					{'social_guess.robinhood':{'$exists':True}}
-				]
-			}
-		)
-
-	# treat
-	def getGoodNewsBackground(self):
-		return self.selector.select(
-			{
-				'beststocksAnalytics.news.bullish':{'$exists':True, '$gte':0.85},
-				'beststocksAnalytics.news.attitude':{'$exists':True, "$in":["Positive"]}
-			}
-		)
+	# treats only tell which tickers match
+	treatProjection = {'ticker': 1, '_id': 0}
 
-	# treat
-	def getTopInvestorsBuying(self):
-		return self.selector.select(
-			{
-				'beststocksAnalytics.investorsTopStat.last7DaysTotalChange':{'$exists':True, '$gt':0}
-			}
-		)
+	def __init__(self, date, selector=None):
+		self.date = date
+		self.selector = selector if selector else SnapshotFiles(date) if SnapshotFiles.directory else Storage(date)
 
-	# treat: lower at least 15% then 52-week highest price
-	def getFallen(self):
-		return self.selector.select(
-			{
-				'closenessToHighest':{'$exists':True, '$lte':0.85}
-			}
-		)
+	def selectTreat(self, treat):
+		return self.selector.select(*IndicatorCompiler.toQuery(Indicators._indicators_db()[treat]['when'], self.date), Indicators.treatProjection)
 
-	# treat: good according to alternative analytics
-	def getGoodScoreBeststocks(self):
-		return self.selector.select(
-			{
-				'beststocksAnalytics.scoreRatio':{'$exists':True, '$gte':0.75}
-			}
-		)
-
-	# treat: large purchases was detected (probably hedge funds)
-	def getBigFishesBuying(self):
-		return self.selector.select(
-			{
-				'flows.largeflow':{'$exists':True, '$gt':0}
-			}
-		)
-
-	# treat: good according to alternative analytics
-	def getGoodScoreWallst(self):
-		return self.selector.select(
-			{
-				'$or':[
-					{
-						'wallstAnalytics.totalScoreRatio':{'$gte':0.75}
-					},
-					{
-						'wallstAnalytics.unfairValueRatio':{'$gte':0.75},
-						'wallstAnalytics.futurePerformanceRatio':{'$gte':0.75},
-						'wallstAnalytics.financialHealthRatio':{'$gte':0.75}
-					}
-				]
-			}
-		)
-
-	def getOversold(self):
-		return self.selector.select(
-			{
-				'wallstAnalytics.unfair_discountPercents':{'$exists':True, '$gt':10},
-				'holders.profitableSharesRatio':{'$exists':True, '$lte':0.75}, 
-				'holders.avgCostToCurrentRatio':{'$exists':True, '$gt':1.05},
-				'trend.currentCostToFareTrend1YRatio':{'$exists':True, '$lt':0.97}, 
-				'trend.currentCostToFareTrend5YRatio':{'$exists':True, '$lt':0.97},
-				'closenessToHighest':{'$exists':True, '$lte':0.85}
-			}
-		)
+	def _projection(fields):
+		# a field inside another projected one would collide with it
+		return dict({field: 1 for field in fields if not any(field.startswith(other + '.') for other in fields)}, _id=0)
 
 	# treat: technical
-	def _any_(self):
-		return self.selector.select({})
+	def _any_(self, projection=None):
+		return self.selector.select({}, False, projection)
 
 	def _indicators_db():
 		return {
 			# company is relient
-			'getStableGrowing': {'in':'Стабильный рост цены (в течение 1 года и 5 лет)', 'out':'Нет стабильного роста цены (в течение 1 года и 5 лет)'},
-			'getOperatingEffective': {'in':'Эффективно управляется (растет темп прибыли из года в год)', 'out':'Неэффективно управляется (темп прибыли не растет из года в год)'},
-			'getOccupationGrowing': {'in':'Стабильно захватывает долю рынка (выручка растет из года в год)', 'out':'Стагнирует (выручка не растет из года в год)'},
-			'getProfitable': {'in':'Прибыльная', 'out':'Убыточная'},
+			'getStableGrowing': {'in':'Стабильный рост цены (в течение 1 года и 5 лет)', 'out':'Нет стабильного роста цены (в течение 1 года и 5 лет)',
+				'when': [{'field': 'trend.costTrend5Y', 'gt': 0}, {'field': 'trend.costTrend1Y', 'gt': 0}]},
+			'getOperatingEffective': {'in':'Эффективно управляется (растет темп прибыли из года в год)', 'out':'Неэффективно управляется (темп прибыли не растет из года в год)',
+				'when': [{'field': 'income.operatingIncomeYoyTrend', 'gt': 0}, {'field': 'income.operatingIncome', 'gt': 0}]},
+			'getOccupationGrowing': {'in':'Стабильно захватывает долю рынка (выручка растет из года в год)', 'out':'Стагнирует (выручка не растет из года в год)',
+				'when': [{'field': 'income.revenueTrend', 'gt': 0.1}, {'field': 'income.revenueTrendLatest', 'gt': 0}]},
+			'getProfitable': {'in':'Прибыльная', 'out':'Убыточная',
+				'when': [{'field': 'income.netIncome', 'gt': 0}]},
 			# company fall recently
-			'getOversold': {'in':'Перепродана', 'out':'Не является перепроданной', 'neutral':True},
-			'getFallen': {'in':'Упала относительно хаев за последний год (минимум на 15%)', 'out':'Близко к хаям за последний год'},
-			'getHoldersInLoss': {'in':'Много держателей в минусе (больше 50%)', 'out':'Много держателей в плюсе'},
-			'getCostBelowFareCost': {'in':'Цена ниже справедливой (той, что должна быть согласно тренду)', 'out':'Цена выше справедливой (той, что должна быть согласно тренду)'},
-			'getDevelopingUnderestimated': {'in':'Недооценена (прибыль растет быстрее цены)', 'out':'Переоценена (цена растет быстрее прибыли)'},
+			'getOversold': {'in':'Перепродана', 'out':'Не является перепроданной', 'neutral':True,
+				'when': [{'field': 'wallstAnalytics.unfair_discountPercents', 'gt': 10}, {'field': 'holders.profitableSharesRatio', 'lte': 0.75}, {'field': 'holders.avgCostToCurrentRatio', 'gt': 1.05}, {'field': 'trend.currentCostToFareTrend1YRatio', 'lt': 0.97}, {'field': 'trend.currentCostToFareTrend5YRatio', 'lt': 0.97}, {'field': 'closenessToHighest', 'lte': 0.85}]},
+			'getFallen': {'in':'Упала относительно хаев за последний год (минимум на 15%)', 'out':'Близко к хаям за последний год',
+				'when': [{'field': 'closenessToHighest', 'lte': 0.85}]},
+			'getHoldersInLoss': {'in':'Много держателей в минусе (больше 50%)', 'out':'Много держателей в плюсе',
+				'when': [{'field': 'holders.profitableSharesRatio', 'lte': 0.5}, {'field': 'holders.avgCostToCurrentRatio', 'gt': 1.05}]},
+			'getCostBelowFareCost': {'in':'Цена ниже справедливой (той, что должна быть согласно тренду)', 'out':'Цена выше справедливой (той, что должна быть согласно тренду)',
+				'when': [{'field': 'trend.costTrend1Y', 'gt': 0}, {'field': 'trend.costTrend5Y', 'gt': 0}, {'field': 'trend.currentCostToFareTrend1YRatio', 'lt': 0.97}, {'field': 'trend.currentCostToFareTrend5YRatio', 'lt': 0.97}]},
+			'getDevelopingUnderestimated': {'in':'Недооценена (прибыль растет быстрее цены)', 'out':'Переоценена (цена растет быстрее прибыли)',
+				'when': [{'field': 'income.revenueTrend', 'gt': 0}, {'subtract': ['income.revenueTrend', 'trend.costTrend5Y'], 'gt': 0}, {'subtract': ['income.revenueTrendLatest', 'trend.costTrend1Y'], 'gt': 0}]},
 			# smart heads interested in company
-			'getInsiderBuying': {'in':'Закупаются инсайдеры', 'out':'Инсайдеры не закупались за последнее время', 'neutral':True},
-			'getTopInvestorsBuying': {'in':'Закупаются лучшие инвесторы', 'out':'Лучшие инвесторы не закупались за последнее время', 'neutral':True},
-			'getBigFishesBuying': {'in':'Закупаются крупные игроки', 'out':'Крупные игроки не закупались за последнее время', 'neutral':True},
-			'getAnalyticsRecommendBuy': {'in':'Уверенные рекомендации к покупке от большинства аналитиков (минимум 70% рекомендуют к покупке)', 'out':'Нет уверенных рекомендации к покупке от большинства аналитиков'},
+			'getInsiderBuying': {'in':'Закупаются инсайдеры', 'out':'Инсайдеры не закупались за последнее время', 'neutral':True,
+				'when': [{'field': 'insiders.purchasedPrice', 'exists': True}]},
+			'getTopInvestorsBuying': {'in':'Закупаются лучшие инвесторы', 'out':'Лучшие инвесторы не закупались за последнее время', 'neutral':True,
+				'when': [{'field': 'beststocksAnalytics.investorsTopStat.last7DaysTotalChange', 'gt': 0}]},
+			'getBigFishesBuying': {'in':'Закупаются крупные игроки', 'out':'Крупные игроки не закупались за последнее время', 'neutral':True,
+				'when': [{'field': 'flows.largeflow', 'gt': 0}]},
+			'getAnalyticsRecommendBuy': {'in':'Уверенные рекомендации к покупке от большинства аналитиков (минимум 70% рекомендуют к покупке)', 'out':'Нет уверенных рекомендации к покупке от большинства аналитиков',
+				'when': [{'field': 'anal.buyCountRatio', 'gte': 0.7}, {'field': 'anal.buyCount', 'gte': 5}, {'field': 'anal.sellCount', 'eq': 0}, {'field': 'anal.targetCostToCurrentRatio', 'gt': 1}]},
 			# company continues growing
-			'getOccupationGrowthBegan': {'in':'Замечен скачек захвата доли рынка за последний год', 'out':'За последний год не было скачка захвата доли рынка'},
-			'getAggressor': {'in':'Агрессор (активно наращивает прибыль и забирает долю рынка)', 'out':'Заторможенность (не активно наращивает прибыль и долю рынка)'},
+			'getOccupationGrowthBegan': {'in':'Замечен скачек захвата доли рынка за последний год', 'out':'За последний год не было скачка захвата доли рынка',
+				'when': [{'field': 'income.revenueYoyTrendLatest', 'gtField': 'income.revenueYoyTrend'}, {'field': 'income.revenueYoyTrendLatest', 'gt': 0}]},
+			'getAggressor': {'in':'Агрессор (активно наращивает прибыль и забирает долю рынка)', 'out':'Заторможенность (не активно наращивает прибыль и долю рынка)',
+				'when': [{'field': f'income.{field}', 'gt': 0} for field in ('operatingIncomeYoyTrendLatest', 'revenueYoyTrendLatest', 'operatingIncomeYoyTrend', 'revenueYoyTrend')]},
 			# positve behaviour
-			'getTechnicalAnalysisGood': {'in':'Технический анализ рекомендует покупать', 'out':'Технический анализ не рекомендует покупать'},
-			'getOptionsPositive': {'in':'На 100% бычий настрой по опционам', 'out':'Нет на 100% бычьего настроя по опционам', 'neutral':True},
-			'getGoodNewsBackground': {'in':'Позитивный новостной фон', 'out':'Нет позитивного новостного фона', 'neutral':True},
+			'getTechnicalAnalysisGood': {'in':'Технический анализ рекомендует покупать', 'out':'Технический анализ не рекомендует покупать',
+				'when': [{'field': f'technical.ta.{period}.{kind}', 'gte': 0} for period in ('day', 'week') for kind in ('oscillators', 'summary', 'ma')]},
+			'getOptionsPositive': {'in':'На 100% бычий настрой по опционам', 'out':'Нет на 100% бычьего настроя по опционам', 'neutral':True,
+				'when': [{'field': 'options', 'exists': True, 'noElement': {'any': [{'field': 'direction', 'eq': 'down'}, {'field': 'expectedCostToCurrentRatio', 'lt': 1}]}}]},
+			'getGoodNewsBackground': {'in':'Позитивный новостной фон', 'out':'Нет позитивного новостного фона', 'neutral':True,
+				'when': [{'field': 'beststocksAnalytics.news.bullish', 'gte': 0.85}, {'field': 'beststocksAnalytics.news.attitude', 'in': ['Positive']}]},
 			# independent analitycs postitive
-			'getGoodScoreWallst': {'in':'Высокая оценка независимым аналитическим сервисом simplywall.st', 'out':'Невысокая оценка независимым аналитическим сервисом simplywall.st'},
-			'getGoodScoreBeststocks': {'in':'Высокая оценка независимым аналитическим сервисом beststocks.ru', 'out':'Невысокая оценка независимым аналитическим сервисом beststocks.ru'},
+			'getGoodScoreWallst': {'in':'Высокая оценка независимым аналитическим сервисом simplywall.st', 'out':'Невысокая оценка независимым аналитическим сервисом simplywall.st',
+				'when': [{'any': [{'field': 'wallstAnalytics.totalScoreRatio', 'gte': 0.75}, {'all': [{'field': f'wallstAnalytics.{field}', 'gte': 0.75} for field in ('unfairValueRatio', 'futurePerformanceRatio', 'financialHealthRatio')]}]}]},
+			'getGoodScoreBeststocks': {'in':'Высокая оценка независимым аналитическим сервисом beststocks.ru', 'out':'Невысокая оценка независимым аналитическим сервисом beststocks.ru',
+				'when': [{'field': 'beststocksAnalytics.scoreRatio', 'gte': 0.75}]},
 			#
-			'getDividendsSoon': {'in':'Скоро дивиденды', 'out':'Дивиденды не намечаются', 'neutral':True},
-			'getResistance5dayBreakout': {'in':'Прорыв линии сопротивления за последние 5 дней', 'out':'Не было прорыва линии сопротивления за последние 5 дней', 'neutral':True},
-			'getMoneyFlowIn': {'in':'Акции чаще покупают, чем продают', 'out':'Акции чаще продают, чем покупают'},
-			'getTechnicallyGood': {'in':'Хорошие показатели PE и EPS', 'out':'Плохие показатели PE и EPS'},
-			'getTightShorts': {'in':'Большой объем открытых шорт-позиций', 'out':'Нет большого объема открытых шорт-позиций', 'neutral':True},
-			'getDividendsPaying': {'in':'Платит дивиденды', 'out':'Не платит дивиденды', 'neutral':True},
-			'getHyped': {'in':'Хайповая', 'out':'Не хайповая', 'neutral':True},
-			'getSocialAttitudeGood': {'in':'Бычий социальный настрой', 'out':'Нет бычьего социального настроя', 'neutral':True}
+			'getDividendsSoon': {'in':'Скоро дивиденды', 'out':'Дивиденды не намечаются', 'neutral':True,
+				'when': [{'field': 'dividend.upcoming.date', 'daysAhead': 30}]},
+			'getResistance5dayBreakout': {'in':'Прорыв линии сопротивления за последние 5 дней', 'out':'Не было прорыва линии сопротивления за последние 5 дней', 'neutral':True,
+				'when': [{'field': 'technical.breakout_magnitude', 'exists': True}]},
+			'getMoneyFlowIn': {'in':'Акции чаще покупают, чем продают', 'out':'Акции чаще продают, чем покупают',
+				'when': [{'field': 'flows.inflowToOutflowRatio', 'gt': 1.1}]},
+			'getTechnicallyGood': {'in':'Хорошие показатели PE и EPS', 'out':'Плохие показатели PE и EPS',
+				'when': [{'field': 'pe', 'lte': 30, 'gte': 0}, {'field': 'eps', 'gte': 0}]},
+			'getTightShorts': {'in':'Большой объем открытых шорт-позиций', 'out':'Нет большого объема открытых шорт-позиций', 'neutral':True,
+				'when': [{'field': 'short.daysToCover', 'gte': 3.5}]},
+			'getDividendsPaying': {'in':'Платит дивиденды', 'out':'Не платит дивиденды', 'neutral':True,
+				'when': [{'field': 'dividend.has', 'eq': True}]},
+			'getHyped': {'in':'Хайповая', 'out':'Не хайповая', 'neutral':True,
+				'when': [{'any': [{'field': 'social_guess.wsb', 'exists': True}, {'field': 'social_guess.robinhood', 'exists': True}]}]},
+			'getSocialAttitudeGood': {'in':'Бычий социальный настрой', 'out':'Нет бычьего социального настроя', 'neutral':True,
+				'when': [{'field': 'social_guess.overall.bullRatio', 'gt': 0.7}, {'field': 'social_guess.overall.bulls', 'gt': 20}, {'field': 'heldSharesRatio', 'gte': 0.7}]}
 		}
 
-	def getIndicators(self):
+	def _indicators_hash():
+		# changes with the names, order or conditions of the treats, that is with the meaning of their bitmasks
+		declarations = [(treat, indicator['when']) for treat, indicator in Indicators._indicators_db().items()]
+		return hashlib.sha1(json.dumps(declarations, sort_keys=True, default=str).encode()).hexdigest()
+
+	def _newIndicators(self, stocks):
 		indicators = {}
-		for stock in self._any_():
-			if not stock['ticker'] in indicators: 
-				indicators[stock['ticker']]= {}
-				indicators[stock['ticker']]['name'] = stock['name'] if 'name' in stock else None
-				indicators[stock['ticker']]['cost'] = stock['currentCost'] if 'currentCost' in stock else None
-				indicators[stock['ticker']]['indicators'] = []
-				indicators[stock['ticker']]['rating'] = 0
+		for stock in stocks:
+			if not stock['ticker'] in indicators:
+				indicators[stock['ticker']] = {
+					'name': stock['name'] if 'name' in stock else None,
+					'cost': stock['currentCost'] if 'currentCost' in stock else None,
+					'indicators': [],
+					'rating': 0
+				}
+		return indicators
+
+	def _addTreat(indicators, ticker, treat, rateInc):
+		indicators[ticker]['indicators'].append(treat)
+		indicators[ticker]['rating'] += 2**rateInc
+
+	def getSnapshot(self):
+		# one projected scan of the day into columns of the fields the treats read
+		fields, listFields = set(), {}
+		for indicator in Indicators._indicators_db().values():
+			fields |= IndicatorCompiler.fields(indicator['when'], listFields)[0]
+		return self.selector.getSnapshot(fields, listFields, ('ticker', 'name', 'currentCost'))
+
+	def evaluate(self, snapshot):
+		# matrix of tickers by treats in _indicators_db order
+		conditions = [indicator['when'] for indicator in Indicators._indicators_db().values()]
+		return numpy.column_stack([IndicatorCompiler.evaluate(when, snapshot, self.date) for when in conditions] + [numpy.zeros((len(snapshot), 0), dtype=bool)])
+
+	def getMasks(self):
+		# treats are evaluated column-wise over a snapshot of the day, the first document of a ticker counts
+		snapshot = self.getSnapshot()
+		matrix = self.evaluate(snapshot)
+		rows = {}
+		for row in range(len(snapshot)):
+			rows.setdefault(snapshot.value('ticker', row), row)
+		return IndicatorMasks.fromMatrix(
+			list(rows.keys()),
+			[snapshot.value('name', row) for row in rows.values()],
+			[snapshot.value('currentCost', row) for row in rows.values()],
+			matrix[list(rows.values())])
+
+	def getIndicators(self):
+		return self.getMasks().toIndicators()
+
+	def getIndicatorsByAggregation(self):
+		# the server evaluates every treat in one $project over the day
+		treats = list(Indicators._indicators_db().items())
+		expressions = {treat: IndicatorCompiler.toExpression(indicator['when'], self.date) for treat, indicator in treats}
+		stocks = list(self.selector.select([{'$project': {'ticker': 1, 'name': 1, 'currentCost': 1, 'treats': expressions}}], True, {'_id': 0}))
+		indicators = self._newIndicators(stocks)
+		seen = set()
+		for stock in stocks:
+			if stock['ticker'] in seen:
+				continue
+			seen.add(stock['ticker'])
+			for index, (treat, _) in enumerate(treats):
+				if stock['treats'][treat]:
+					Indicators._addTreat(indicators, stock['ticker'], treat, len(treats) - index)
+		return indicators
+
+	def getIndicatorsByQueries(self):
+		# one query per treat, the reference for the other backends
+		indicators = self._newIndicators(self._any_(Indicators._projection({'ticker', 'name', 'currentCost'})))
 		treats = Indicators._indicators_db().keys()
 		rateInc = len(treats)
 		for treat in treats:
-			for stock in getattr(self, treat)():
-				indicators[stock['ticker']]['indicators'].append(treat)
-				indicators[stock['ticker']]['rating'] += 2**rateInc
+			for stock in self.selectTreat(treat):
+				Indicators._addTreat(indicators, stock['ticker'], treat, rateInc)
 			rateInc -= 1 # the lower the treat the lesser its rate
 		return indicators
 
 
+class IndicatorMasks:
+
+	# Indicators of the tickers of a day as a bitmask per ticker, bit i is the i-th treat of _indicators_db.
+	# The rating of a ticker is the sum of 2**(number of treats - i) over its bits, so an earlier treat
+	# outweighs all the later ones, and ratings, places, AI features and descriptions all derive from the bitmasks.
+
+	# bits of the uint32 masks, kept by the history files and the AI model as well
+	maxTreats = 32
+
+	def __init__(self, tickers, names, costs, masks):
+		self.treats = list(Indicators._indicators_db().keys())
+		if len(self.treats) > IndicatorMasks.maxTreats:
+			raise Exception(f'{len(self.treats)} indicators do not fit the {IndicatorMasks.maxTreats} bits of a mask')
+		self.tickers = tickers
+		self.names = names
+		self.costs = costs
+		self.masks = masks
+
+	def fromMatrix(tickers, names, costs, matrix):
+		# matrix of tickers by treats in _indicators_db order
+		if matrix.shape[1] > IndicatorMasks.maxTreats:
+			raise Exception(f'{matrix.shape[1]} indicators do not fit the {IndicatorMasks.maxTreats} bits of a mask')
+		bits = numpy.left_shift(numpy.uint32(1), numpy.arange(matrix.shape[1], dtype=numpy.uint32))
+		return IndicatorMasks(tickers, names, costs, (matrix.astype(numpy.uint32) @ bits).astype(numpy.uint32))
+
+	def __len__(self):
+		return len(self.masks)
+
+	def features(self):
+		# matrix of tickers by treats, 1 when the ticker has the treat
+		return ((self.masks[:, None] >> numpy.arange(len(self.treats), dtype=numpy.uint32)) & 1).astype(numpy.uint8)
+
+	def ratings(self):
+		weights = numpy.left_shift(numpy.int64(1), len(self.treats) - numpy.arange(len(self.treats), dtype=numpy.int64))
+		return self.features().astype(numpy.int64) @ weights
+
+	def places(self):
+		# 1 + the number of tickers rated strictly higher, found in the sorted ratings
+		ratings = self.ratings()
+		return len(ratings) - numpy.searchsorted(numpy.sort(ratings), ratings, side='right') + 1
+
+	def toIndicators(self):
+		# indicators of every ticker as the other backends give them: names of its treats and its rating
+		treats = numpy.array(self.treats, dtype=object)
+		features = self.features().astype(bool)
+		return {ticker: {
+			'name': name,
+			'cost': cost,
+			'indicators': treats[row].tolist(),
+			'rating': rating
+		} for ticker, name, cost, row, rating in zip(self.tickers, self.names, self.costs, features, self.ratings().tolist())}
+
+
+class History:
+
+	# Days of indicators as arrays in the ticker order of each day: a bitmask of the indicators of a ticker
+	# (bit i is the i-th treat of _indicators_db), its rating and its price, NaN when unknown.
+	# Days are aligned on one column per ticker, and pairs of days are built by vectorized blocks.
+	# Arrays of a day are computed once and kept in cacheDir, pairs are kept in the history file and
+	# only the pairs of days new to it are built. Both are built again when the treats are declared otherwise.
+
+	cacheDir = 'history_days'
+	dayArrays = ('tickers', 'masks', 'ratings', 'prices')
+	pairColumns = ('masks', 'days_diff', 'growth_percent', 'day')
+
+	def __init__(self):
+		self.treats = list(Indicators._indicators_db().keys())
+		self.indicators = Indicators._indicators_hash()
+		self.dates = []
+		self.days = []
+		# IndicatorMasks of the days computed by this history, None for the cached ones
+		self.masks = []
+		# days which may still change are not cached, nor taken as known by the history file
+		self.final = []
+
+	def _price(cost):
+		return float(cost) if isinstance(cost, (int, float)) and not isinstance(cost, bool) else numpy.nan
+
+	def _isCurrent(self, stored):
+		return 'indicators' in stored.files and str(stored['indicators']) == self.indicators
+
+	def add(self, date, masks):
+		self.dates.append(date)
+		self.final.append(False)
+		self.masks.append(masks)
+		self.days.append({
+			'tickers': numpy.array(masks.tickers, dtype=str),
+			'masks': masks.masks,
+			'ratings': masks.ratings(),
+			'prices': numpy.array([History._price(cost) for cost in masks.costs], dtype=numpy.float64),
+		})
+
+	def addDay(self, date, cache = True):
+		# False when there is no data of the day, the latest day may still change so it is not cached
+		filename = os.path.join(History.cacheDir, date.strftime('%Y_%m_%d.npz'))
+		if cache and os.path.exists(filename):
+			stored = numpy.load(filename)
+			if self._isCurrent(stored):
+				self.dates.append(date)
+				self.days.append({key: stored[key] for key in History.dayArrays})
+				self.final.append(True)
+				self.masks.append(None)
+				return True
+		try:
+			indicators = Indicators(date)
+		except Exception:
+			return False
+		self.add(date, indicators.getMasks())
+		if cache:
+			os.makedirs(History.cacheDir, exist_ok=True)
+			numpy.savez(filename, treats=numpy.array(self.treats), indicators=self.indicators, **self.days[-1])
+			self.final[-1] = True
+		return True
+
+	def _align(self):
+		index = {}
+		columns = [numpy.array([index.setdefault(ticker, len(index)) for ticker in day['tickers']], dtype=numpy.int64) for day in self.days]
+		masks = numpy.zeros((len(self.days), len(index)), dtype=numpy.uint32)
+		prices = numpy.full((len(self.days), len(index)), numpy.nan)
+		for row, (day, column) in enumerate(zip(self.days, columns)):
+			masks[row, column] = day['masks']
+			prices[row, column] = day['prices']
+		return list(index), columns, masks, prices
+
+	def _positions(self, columns, width):
+		# position of a ticker within its day, to keep the rows of a day in its ticker order
+		positions = numpy.zeros((len(columns), width), dtype=numpy.int64)
+		for row, column in enumerate(columns):
+			positions[row, column] = numpy.arange(len(column))
+		return positions
+
+	def _ordinals(self):
+		return numpy.array([date.toordinal() for date in self.dates], dtype=numpy.int32)
+
+	def getPairs(self, minDaysDiff, new = None):
+		# for every ticker priced on both days of a pair at least minDaysDiff apart, with at least one of the days new:
+		# its bitmask at the earlier day, the days between them, the growth of the price in percents and the later day
+		tickers, columns, masks, prices = self._align()
+		positions = self._positions(columns, len(tickers))
+		days = self._ordinals()
+		new = numpy.ones(len(days), dtype=bool) if new is None else new
+		priced = numpy.isfinite(prices) & (prices != 0)
+		blocks = [(numpy.zeros(0, dtype=numpy.uint32), numpy.zeros(0, dtype=numpy.int32), numpy.zeros(0), numpy.zeros(0, dtype=numpy.int32))]
+		for current in range(len(days)):
+			# one block per day against all of its earlier days
+			previous = days[current] - days[:current] >= minDaysDiff
+			if not new[current]:
+				previous &= new[:current]
+			previous = numpy.flatnonzero(previous)
+			rows, column = numpy.nonzero(priced[previous] & priced[current])
+			previous = previous[rows]
+			order = numpy.lexsort((positions[previous, column], previous))
+			previous, column = previous[order], column[order]
+			growth = numpy.round(100 * (prices[current, column] - prices[previous, column]) / prices[previous, column], 2)
+			blocks.append((masks[previous, column], days[current] - days[previous], growth, numpy.full(len(column), days[current], dtype=numpy.int32)))
+		return {name: numpy.concatenate(block) for name, block in zip(History.pairColumns, zip(*blocks))}
+
+	def save(self, filename, minDaysDiff):
+		# pairs of the days already in the file are kept and pairs with a day out of the window dropped,
+		# rows are in the order of a full build: by later day, earlier day and the ticker order of the earlier day
+		days = self._ordinals()
+		known = numpy.zeros(len(days), dtype=bool)
+		pairs = None
+		if os.path.exists(filename):
+			stored = numpy.load(filename)
+			if self._isCurrent(stored) and int(stored['min_days_diff']) == minDaysDiff:
+				known = numpy.isin(days, stored['dates'])
+				kept = numpy.isin(stored['day'], days[known]) & numpy.isin(stored['day'] - stored['days_diff'], days[known])
+				pairs = {column: stored[column][kept] for column in History.pairColumns}
+		built = self.getPairs(minDaysDiff, ~known)
+		if pairs is None:
+			pairs = built
+		else:
+			pairs = {column: numpy.concatenate((pairs[column], built[column])) for column in History.pairColumns}
+			if known.any() and (~known).any() and days[~known].min() < days[known].max():
+				order = numpy.lexsort((pairs['day'] - pairs['days_diff'], pairs['day']))
+				pairs = {column: values[order] for column, values in pairs.items()}
+		numpy.savez(filename, treats=numpy.array(self.treats), indicators=self.indicators, min_days_diff=minDaysDiff, dates=days[numpy.array(self.final, dtype=bool)], **pairs)
+		return len(pairs['masks']), len(built['masks'])
+
+	def getBestTickers(self, top):
+		# tickers in the top of any day but the latest, with the best ratio of a later price to the price of their first such day
+		tickers, columns, masks, prices = self._align()
+		firstDays = {}
+		for row in range(len(self.days) - 1):
+			for column in columns[row][numpy.argsort(self.days[row]['ratings'], kind='stable')[-top:]]:
+				firstDays.setdefault(column, row)
+		stats = {}
+		for column, row in firstDays.items():
+			firstPrice = prices[row, column]
+			with numpy.errstate(divide='ignore', invalid='ignore'):
+				ratios = prices[row + 1:, column] / firstPrice
+			ratios = ratios[numpy.isfinite(ratios)]
+			stats[tickers[column]] = {
+				'first_price': None if numpy.isnan(firstPrice) else float(firstPrice),
+				'best_ratio': max(0, float(ratios.max())) if len(ratios) else 0
+			}
+		return stats
+
+
 class Report:
 
-	aiHistoryFile = 'history.csv'
+	aiHistoryFile = 'history.npz'
 
 	def _findLatestIndicatorsDate(self, closestDate):
 		while True:
@@ -391,35 +571,31 @@ class Report:
 				closestDate -= datetime.timedelta(days=1)
 				continue
 
-	def _getPredictions(self, aiModel, indicators):
-		predictions = {}
-		for ticker in indicators:
-			predictions[ticker] = aiModel.getPrediction({indicator:(indicator in indicators[ticker]['indicators']) for indicator in Indicators._indicators_db()})
-		return predictions
+	def _getPredictions(self, aiModel, masks):
+		return dict(zip(masks.tickers, aiModel.predict_batch(masks.features(), masks.treats)))
 
 	def getAutonomousDataAsJson(self):
-		latestIndicatorsData = Indicators(self._findLatestIndicatorsDate(datetime.datetime.now())).getIndicators()
-		aiModel = ai.AI.load(historyFile=self.aiHistoryFile)
-		predictions = self._getPredictions(aiModel, latestIndicatorsData)
-		indicators = Indicators._indicators_db()
+		masks = Indicators(self._findLatestIndicatorsDate(datetime.datetime.now())).getMasks()
+		aiModel = ai.AI.load()
+		predictions = self._getPredictions(aiModel, masks)
+		indicators = list(Indicators._indicators_db().values())
 		autonomousData = {}
-		for ticker in latestIndicatorsData:
-			autonomousData[ticker] = {
-				'place': sum(1 for item in latestIndicatorsData if latestIndicatorsData[item]['rating']>latestIndicatorsData[ticker]['rating']) + 1,
-				'total': len(latestIndicatorsData.keys()),
-				'name': latestIndicatorsData[ticker]['name'],
+		for ticker, name, mask, place in zip(masks.tickers, masks.names, masks.masks.tolist(), masks.places().tolist()):
+			data = {
+				'place': place,
+				'total': len(masks),
+				'name': name,
 				'pluses': [],
 				'neutrals': [],
 				'minuses': [],
 				'prediction': predictions[ticker]
 				}
-			for indicator in latestIndicatorsData[ticker]['indicators']:
-				autonomousData[ticker]['pluses'].append(indicators[indicator]['in'])
-			for indicator in set(indicators.keys())-set(latestIndicatorsData[ticker]['indicators']):
-				if 'neutral' in indicators[indicator]:
-					autonomousData[ticker]['neutrals'].append(indicators[indicator]['out'])
+			for index, indicator in enumerate(indicators):
+				if mask >> index & 1:
+					data['pluses'].append(indicator['in'])
 				else:
-					autonomousData[ticker]['minuses'].append(indicators[indicator]['out'])
+					data['neutrals' if 'neutral' in indicator else 'minuses'].append(indicator['out'])
+			autonomousData[ticker] = data
 		return json.dumps(autonomousData, ensure_ascii=False)
 
 	def printLatestIndicatorsReport(self, now):
@@ -431,54 +607,32 @@ class Report:
 			indicators = ' + '.join(item[1]['indicators'])
 			print(f'{ticker:5}[{indicatorsCount:2},{rating:3}] ({name:10}): {indicators}')
 
-	def printHistoricalReport(self, start, end):
-		bestTickersHistoryStats = {}
+	def printHistoricalReport(self, start, end, fullTraining = False):
+		history = History()
 		current = start
-		prevRatings = []
-		indicators = list(Indicators._indicators_db().keys())
-		with open(self.aiHistoryFile, 'w') as f:
-			aiHistoryFile = csv.writer(f)
-			aiHistoryFile.writerow(indicators + ['days_diff', 'growth_percent'])
-			while current<=end:
-				try:
-					rating = Indicators(current)
-				except:
-					current += datetime.timedelta(days=1)
-					continue
-				curRating = rating.getIndicators()
-				# go through all previous days
-				for prevRating in prevRatings:
-					# top N growth stats
-					for item in sorted(prevRating['tickers'].items(), key=lambda x: x[1]['rating'])[-5:]:
-						ticker = item[0]
-						if ticker not in bestTickersHistoryStats:
-							bestTickersHistoryStats[ticker] = {'first_price': prevRating['tickers'][ticker]['cost'], 'best_ratio': 0}
-					for ticker in bestTickersHistoryStats:
-						if ticker in curRating and curRating[ticker]['cost'] is not None and bestTickersHistoryStats[ticker]['first_price'] is not None:
-							ratio = curRating[ticker]['cost']/float(bestTickersHistoryStats[ticker]['first_price'])
-							bestTickersHistoryStats[ticker]['best_ratio'] = bestTickersHistoryStats[ticker]['best_ratio'] if ratio < bestTickersHistoryStats[ticker]['best_ratio'] else ratio
-					# collect ticker growth data since PREV to CURRENT
-					for ticker in prevRating['tickers']:
-						if ticker in curRating and curRating[ticker]['cost'] and prevRating['tickers'][ticker]['cost']:
-							daysDiff = (current-prevRating['date']).days
-							growthPerc = round(100 * ((curRating[ticker]['cost'] - prevRating['tickers'][ticker]['cost']) / float(prevRating['tickers'][ticker]['cost'])), 2)
-							aiHistoryFile.writerow([int(indicator in prevRating['tickers'][ticker]['indicators']) for indicator in indicators] + [daysDiff, growthPerc])
-				prevRatings.append({'tickers':curRating, 'date':current})
-				current += datetime.timedelta(days=1)
+		started = time.time()
+		while current<=end:
+			# the day of end may still be crawled, whatever time of it end is
+			history.addDay(current, current.date() < end.date())
+			current += datetime.timedelta(days=1)
+		pairs, built = history.save(self.aiHistoryFile, ai.AI.minDaysDiff)
+		bestTickersHistoryStats = history.getBestTickers(5)
 		# 
 		print(f'[{datetime.datetime.now()}]{"-"*100} (history analyzed days)\n')
-		for day in prevRatings:
-			print(day['date'])
+		for date in history.dates:
+			print(date)
+		print(f'{pairs} history pairs, {built} of them new, in {round(time.time() - started, 2)}s')
 		# 
 		print(f'[{datetime.datetime.now()}]{"-"*100} (AI training)')
-		aiModel = ai.AI.create(historyFile=self.aiHistoryFile)
+		aiModel = ai.AI.update(historyFile=self.aiHistoryFile, full=fullTraining)
 		aiModel.printModelInfo()
 		# 
 		print(f'\n[{datetime.datetime.now()}]{"-"*100} (tickers top by indicators)\n')
-		latestDate = prevRatings[-1]['date']
+		latestDate = history.dates[-1]
 		print(f'Latest data = {latestDate}')
-		latestIndicatorsData = Indicators(latestDate).getIndicators()
-		predictions = self._getPredictions(aiModel, latestIndicatorsData)
+		latestMasks = history.masks[-1] if history.masks[-1] is not None else Indicators(latestDate).getMasks()
+		latestIndicatorsData = latestMasks.toIndicators()
+		predictions = self._getPredictions(aiModel, latestMasks)
 		line = 0
 		for item in sorted(latestIndicatorsData.items(), key=lambda x: x[1]['rating']):
 			ticker = item[0]
@@ -511,20 +665,28 @@ class UserInterface:
 
 	def __init__(self):
 		parser = argparse.ArgumentParser(description='Collected stocks data analyzer')
+		parser.add_argument('--snapshots', dest='snapshots', default=None, help='Directory of days exported by the crawler, read instead of MongoDB')
 		subparsers = parser.add_subparsers(dest="command", help='Commands')
 		report = subparsers.add_parser('report', help='Print full report for all tickers')
 		report.add_argument('--no-history', dest='nohistory', action='store_true', default=False, help='Without history analysis')
+		report.add_argument('--full-training', dest='fulltraining', action='store_true', default=False, help='Train the AI model from scratch instead of updating it with new history')
 		latestdata = subparsers.add_parser('latestdata', help='Dumps latest data in JSON format to file')
 		latestdata.add_argument('--to-file', dest='filename', default=False, help='Without history analysis')
+		check = subparsers.add_parser('check', help='Compares indicators of every backend with per-query ones')
+		check.add_argument('--date', dest='date', default=None, help='Day of collected data, YYYY-MM-DD, latest by default')
+		check.add_argument('--days', dest='days', type=int, default=1, help='Number of collected days to check, back from the date')
 		self.args = parser.parse_args()
 
 	def go(self):
+		SnapshotFiles.directory = self.args.snapshots
 		if self.args.command == 'report':
-			self.report(self.args.nohistory)
+			self.report(self.args.nohistory, self.args.fulltraining)
 		elif self.args.command == 'latestdata':
 			self.latestdata(self.args.filename)
+		elif self.args.command == 'check':
+			self.check(self.args.date, self.args.days)
 
-	def report(self, without_history):
+	def report(self, without_history, full_training):
 		#date_from = datetime.datetime(2021,6,27)
 		#date_till= datetime.datetime(2021,11,3)
 		date_from = datetime.datetime.now() - datetime.timedelta(days=150)
@@ -533,10 +695,41 @@ class UserInterface:
 		if without_history:
 			report.printLatestIndicatorsReport(date_till)
 		else:
-			report.printHistoricalReport(date_from, date_till)
+			report.printHistoricalReport(date_from, date_till, full_training)
 
 	def latestdata(self, filename):
 		open(filename, 'w').write(Report().getAutonomousDataAsJson())
 
+	def check(self, date, days):
+		date = datetime.datetime.strptime(date, '%Y-%m-%d') if date else Report()._findLatestIndicatorsDate(datetime.datetime.now())
+		backends = {'per-query': 'getIndicatorsByQueries', 'aggregation': 'getIndicatorsByAggregation', 'numpy': 'getIndicators'}
+		differ = 0
+		checked = 0
+		while checked < days:
+			try:
+				indicators = Indicators(date)
+				# query backends run on Mongo, a day read from the exported files is compared with it
+				queries = Indicators(date, Storage(date)) if SnapshotFiles.directory else indicators
+			except Exception:
+				date -= datetime.timedelta(days=1)
+				if date < datetime.datetime(2021, 1, 1):
+					break
+				continue
+			results, timings = {}, []
+			for backend, method in backends.items():
+				started = time.time()
+				results[backend] = getattr(queries if method != 'getIndicators' else indicators, method)()
+				timings.append(f'{backend} {round(time.time() - started, 2)}s')
+			byQueries = results['per-query']
+			print(f'{date:%Y-%m-%d}: {len(byQueries)} tickers, {", ".join(timings)}')
+			for backend, result in results.items():
+				for ticker in sorted(ticker for ticker in byQueries.keys() | result.keys() if byQueries.get(ticker) != result.get(ticker)):
+					print(f'{ticker}: per-query {byQueries.get(ticker)}, {backend} {result.get(ticker)}')
+					differ += 1
+			checked += 1
+			date -= datetime.timedelta(days=1)
+		if differ:
+			raise SystemExit(f'{differ} ticker results differ')
+
 if __name__ == '__main__':
 	UserInterface().go()
\ No newline at end of file
@@ -12,28 +12,354 @@ import pprint
 import tabulate
 import textwrap
 import urllib3
+import threading
+import concurrent.futures
+import asyncio
+import sqlite3
+import hashlib
+import random
+import uuid
+import collections
+import socket
+import signal
+import sys
+import os
 from bs4 import BeautifulSoup
 import re
 
+class ResponseCache:
+
+	# freshness per endpoint class: (name, host, path pattern, seconds, key of a valid response),
+	# responses without the key are errors of the source for the sections reading them, and are not stored
+	policies = [
+		('search', 'quotes-gw.webullfintech.com', r'^/api/search/list\?', 7*24*3600, 'stocks'),
+		('financial', 'quotes-gw.webullfintech.com', r'^/api/information/financial/index\?', 7*24*3600, 'simpleStatement'),
+		('brief', 'quotes-gw.webullfintech.com', r'^/api/information/stock/brief\?', 30*24*3600, 'sectors'),
+		# latest bar feeds currentCostToFareTrend5YRatio, so reuse only within a crawl day
+		('trend5Y', 'quoteapi.webullfintech.com', r'^/api/quote/v2/tickerTrends/\d+\?trendType=y5$', 20*3600, 'tickerKDatas'),
+		('wallstIdentity', '17iqhzwxzw-dsn.algolia.net', r'^/1/indexes/companies/query$', 90*24*3600, 'hits'),
+	]
+
+	def __init__(self, filename, maxBytes):
+		self.lock = threading.Lock()
+		self.maxBytes = maxBytes
+		self.connection = sqlite3.connect(filename, timeout=30, check_same_thread=False, isolation_level=None)
+		self.connection.execute('PRAGMA journal_mode=WAL')
+		self.connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, stored REAL, accessed REAL, size INTEGER, content BLOB)')
+		self.connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+		self.size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+		self.stats = {policy[0]: {'hits': 0, 'misses': 0} for policy in ResponseCache.policies}
+		self.evicted = 0
+		self.rejected = 0
+
+	def _getPolicy(self, host, path):
+		for policy in ResponseCache.policies:
+			if policy[1] == host and re.search(policy[2], path):
+				return policy
+		return None
+
+	def _getKey(self, host, path, body):
+		return hashlib.sha1(f'{host}\n{path}\n{body or ""}'.encode()).hexdigest()
+
+	def get(self, host, path, body):
+		policy = self._getPolicy(host, path)
+		if not policy:
+			return None
+		key = self._getKey(host, path, body)
+		with self.lock:
+			row = self.connection.execute('SELECT stored, content FROM responses WHERE key = ?', (key,)).fetchone()
+			if row and row[0] + policy[3] > time.time():
+				self.connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+				self.stats[policy[0]]['hits'] += 1
+				return row[1]
+			self.stats[policy[0]]['misses'] += 1
+		return None
+
+	def _isValid(policy, content):
+		try:
+			data = json.loads(content)
+		except ValueError:
+			return False
+		return isinstance(data, dict) and policy[4] in data
+
+	def put(self, host, path, body, content):
+		policy = self._getPolicy(host, path)
+		if not policy:
+			return
+		if not ResponseCache._isValid(policy, content):
+			self.rejected += 1
+			return
+		key = self._getKey(host, path, body)
+		with self.lock:
+			row = self.connection.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+			self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)', (key, time.time(), time.time(), len(content), content))
+			self.size += len(content) - (row[0] if row else 0)
+			if self.size > self.maxBytes:
+				# other processes sharing the file store and evict too, the tracked size is only a hint
+				self.size = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+			# least recently used responses go first
+			while self.size > self.maxBytes:
+				rows = self.connection.execute('SELECT key, size FROM responses ORDER BY accessed LIMIT 100').fetchall()
+				if not rows:
+					self.size = 0
+					break
+				self.connection.executemany('DELETE FROM responses WHERE key = ?', [(row[0],) for row in rows])
+				self.size -= sum(row[1] for row in rows)
+				self.evicted += len(rows)
+
+	def printStats(self):
+		for name, stat in self.stats.items():
+			print(f"Cache | {name}: {stat['hits']} hits, {stat['misses']} misses")
+		print(f"Cache | {round(self.size/2**20, 2)}MB stored, {self.evicted} responses evicted, {self.rejected} error responses not stored")
+
+
+class HostLimiter:
+
+	# token bucket for the request rate plus AIMD window for concurrent requests of one host:
+	# fast successful responses grow the window by one per window, 429/5xx/errors halve window and rate
+	targetLatency = 2.0
+	decreaseInterval = 2.0
+	backoffBase = 1.0
+	backoffMax = 30.0
+
+	def __init__(self, host, maxLimit, maxRate):
+		self.host = host
+		self.lock = threading.Lock()
+		self.maxLimit = maxLimit
+		self.maxRate = float(maxRate)
+		self.limit = max(1.0, maxLimit / 2.0)
+		self.rate = self.maxRate
+		self.tokens = self.rate
+		self.updated = time.time()
+		self.decreased = 0
+		self.inflight = 0
+
+	def _reserve(self):
+		# 0 when a request may start now, otherwise seconds to wait
+		with self.lock:
+			now = time.time()
+			self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+			self.updated = now
+			if self.inflight >= int(self.limit):
+				return 0.05
+			if self.tokens < 1:
+				return (1 - self.tokens) / self.rate
+			self.tokens -= 1
+			self.inflight += 1
+			return 0
+
+	def acquire(self):
+		delay = self._reserve()
+		while delay:
+			time.sleep(delay)
+			delay = self._reserve()
+
+	async def acquireAsync(self):
+		delay = self._reserve()
+		while delay:
+			await asyncio.sleep(delay)
+			delay = self._reserve()
+
+	def release(self, latency, status):
+		# status is None when the request failed without response
+		with self.lock:
+			self.inflight -= 1
+			previous = int(self.limit), self.rate
+			if status is None or HostLimiter.isOverloaded(status):
+				# one decrease per interval, the whole window of requests fails together
+				if time.time() - self.decreased > HostLimiter.decreaseInterval:
+					self.decreased = time.time()
+					self.limit = max(1.0, self.limit / 2)
+					self.rate = max(1.0, self.rate / 2)
+			elif latency < HostLimiter.targetLatency:
+				self.limit = min(float(self.maxLimit), self.limit + 1 / self.limit)
+				self.rate = min(self.maxRate, self.rate + 1 / self.limit)
+			if int(self.limit) != previous[0] or int(self.rate) != int(previous[1]):
+				reason = 'error' if status is None else str(status)
+				HttpApi.log(f"Limiter | {self.host}: {int(self.limit)} concurrent, {round(self.rate, 1)} req/s (last {reason}, {round(latency, 2)}s)")
+
+	def isOverloaded(status):
+		return status == 429 or status >= 500
+
+	def getBackoff(attempt, retryAfter = None):
+		# exponential with full jitter, server hint wins
+		if retryAfter and str(retryAfter).isdigit():
+			return min(HostLimiter.backoffMax, float(retryAfter))
+		return random.uniform(0, min(HostLimiter.backoffMax, HostLimiter.backoffBase * 2**attempt))
+
+
+class HostUnavailable(Exception):
+	pass
+
+
+class CircuitBreaker:
+
+	# closed: requests pass, open: requests to the host fail fast during cooldown, half-open: one probe request decides
+	failureThreshold = 5
+	cooldown = 60
+
+	def __init__(self, host):
+		self.host = host
+		self.lock = threading.Lock()
+		self.state = 'closed'
+		self.failures = 0
+		self.opened = 0
+		self.probing = False
+		self.skipped = 0
+
+	def allow(self):
+		with self.lock:
+			if self.state == 'open' and time.time() - self.opened >= CircuitBreaker.cooldown:
+				self.state, self.probing = 'half-open', False
+			if self.state == 'closed':
+				return True
+			if self.state == 'half-open' and not self.probing:
+				self.probing = True
+				return True
+			self.skipped += 1
+			return False
+
+	def record(self, success):
+		with self.lock:
+			if success:
+				if self.state != 'closed':
+					HttpApi.log(f"Breaker | {self.host}: closed")
+				self.state, self.failures = 'closed', 0
+				return
+			self.failures += 1
+			if self.state == 'half-open' or (self.state == 'closed' and self.failures >= CircuitBreaker.failureThreshold):
+				HttpApi.log(f"Breaker | {self.host}: open for {CircuitBreaker.cooldown}s after {self.failures} failures")
+				self.state, self.opened, self.probing = 'open', time.time(), False
+
+
 class HttpApi:
 
+	# process-wide keep-alive pool: one session per host, shared by every api instance
+	sessions = {}
+	sessionsLock = threading.Lock()
+	poolSize = 10
+	connectTimeout = 5
+	readTimeout = 5
+	# upper bounds of the adaptive per-host limits: concurrent requests and requests per second
+	hostLimit = 8
+	hostRate = 20
+	limiters = {}
+	breakers = {}
+	retries = 2
+	# on-disk ResponseCache, off when None
+	cache = None
+	# messages of limiters and breakers from worker threads, printed between tickers in their output order
+	messages = collections.deque()
+
+	def configure(poolSize = None, connectTimeout = None, readTimeout = None, hostLimit = None, hostRate = None):
+		HttpApi.poolSize = poolSize or HttpApi.poolSize
+		HttpApi.connectTimeout = connectTimeout or HttpApi.connectTimeout
+		HttpApi.readTimeout = readTimeout or HttpApi.readTimeout
+		HttpApi.hostLimit = hostLimit or HttpApi.hostLimit
+		HttpApi.hostRate = hostRate or HttpApi.hostRate
+
+	def _getSession(host):
+		with HttpApi.sessionsLock:
+			if host not in HttpApi.sessions:
+				urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+				adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(HttpApi.poolSize, HttpApi.hostLimit))
+				session = requests.Session()
+				session.mount('https://', adapter)
+				session.mount('http://', adapter)
+				session.verify = False
+				HttpApi.sessions[host] = session
+			return HttpApi.sessions[host]
+
+	def _getLimiter(host):
+		with HttpApi.sessionsLock:
+			if host not in HttpApi.limiters:
+				HttpApi.limiters[host] = HostLimiter(host, HttpApi.hostLimit, HttpApi.hostRate)
+			return HttpApi.limiters[host]
+
+	def _getBreaker(host):
+		with HttpApi.sessionsLock:
+			if host not in HttpApi.breakers:
+				HttpApi.breakers[host] = CircuitBreaker(host)
+			return HttpApi.breakers[host]
+
+	def getPoolStats():
+		stats = {}
+		with HttpApi.sessionsLock:
+			for host, session in HttpApi.sessions.items():
+				opened, requested = 0, 0
+				for adapter in set(session.adapters.values()):
+					pools = adapter.poolmanager.pools
+					for key in pools.keys():
+						pool = pools.get(key)
+						if pool:
+							opened += pool.num_connections
+							requested += pool.num_requests
+				stats[host] = {'opened': opened, 'reused': requested - opened}
+		return stats
+
+	def log(message):
+		HttpApi.messages.append(message)
+
+	def printMessages():
+		while HttpApi.messages:
+			print(HttpApi.messages.popleft())
+
+	def printPoolStats():
+		HttpApi.printMessages()
+		for host, stat in sorted(HttpApi.getPoolStats().items()):
+			print(f"Pool | {host}: {stat['opened']} connections opened, {stat['reused']} requests reused connection")
+		for host, limiter in sorted(HttpApi.limiters.items()):
+			print(f"Limiter | {host}: {int(limiter.limit)} concurrent, {round(limiter.rate, 1)} req/s at finish")
+		for host, breaker in sorted(HttpApi.breakers.items()):
+			if breaker.skipped:
+				print(f"Breaker | {host}: {breaker.skipped} requests skipped, {breaker.state} at finish")
+
 	def _request_internal(self, host, path, headers = {}, body = None, protocol = 'https://'):
-		headers['User-Agent'] = 'okhttp/3.12.1'
-		headers['Host'] = host
+		headers = dict(headers, **{'User-Agent': 'okhttp/3.12.1', 'Host': host})
 		url = protocol + host + path
-		urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-		if not body:	
-			response = requests.get(url, headers = headers, timeout=5, verify=False).content
-		else:
-			response = requests.post(url, headers = headers, data = body, timeout=5, verify=False).content
+		session = HttpApi._getSession(host)
+		timeout = (HttpApi.connectTimeout, HttpApi.readTimeout)
+		limiter = HttpApi._getLimiter(host)
+		limiter.acquire()
+		started, status = time.time(), None
+		try:
+			if not body:	
+				response = session.get(url, headers = headers, timeout=timeout)
+			else:
+				response = session.post(url, headers = headers, data = body, timeout=timeout)
+			status = response.status_code
+		finally:
+			limiter.release(time.time() - started, status)
+		if HttpApi.cache and response.status_code == 200 and response.content:
+			HttpApi.cache.put(host, path, body, response.content)
 		return response
 
 	def request(self, host, path, headers = {}, body = None, protocol = 'https://'):
-		try:
-			return self._request_internal(host, path, headers, body, protocol)
-		except:
-			time.sleep(2)
-			return self._request_internal(host, path, headers, body, protocol)
+		cached = HttpApi.cache.get(host, path, body) if HttpApi.cache else None
+		if cached is not None:
+			return cached
+		breaker = HttpApi._getBreaker(host)
+		if not breaker.allow():
+			raise HostUnavailable(f'{host} circuit is open')
+		for attempt in range(HttpApi.retries + 1):
+			if breaker.state == 'open':
+				raise HostUnavailable(f'{host} circuit is open')
+			try:
+				response = self._request_internal(host, path, headers, body, protocol)
+			except Exception:
+				if attempt == HttpApi.retries:
+					breaker.record(False)
+					raise
+				time.sleep(HostLimiter.getBackoff(attempt))
+				continue
+			overloaded = HostLimiter.isOverloaded(response.status_code)
+			if not overloaded or attempt == HttpApi.retries:
+				breaker.record(not overloaded)
+				if overloaded:
+					# a source still overloaded after retries is as unavailable as a dead one
+					raise HostUnavailable(f'{host} answered {response.status_code}')
+				return response.content
+			time.sleep(HostLimiter.getBackoff(attempt, response.headers.get('Retry-After')))
 
 
 class JsonApi(HttpApi):
@@ -59,27 +385,77 @@ class StockbeepApi(JsonApi):
 	# global siglethon cache
 	breakouts = None
 	trendings = None
+	# cache-busting timestamp, fixed per process so a replayed request stays the same
+	requestTime = int(time.time()*1000)
+	# {symbol: row} of the lists above
+	breakoutsIndex = None
+	trendingsIndex = None
+	# pages are checked and fetched under the lock, so concurrent tickers download them once
+	pagesLock = threading.RLock()
 
 	def getBreakoutStocks(self):
-		if StockbeepApi.breakouts == None:
-			StockbeepApi.breakouts = self._getJson('stockbeep.com', f'/table-data/range-breakout-stocks?country=us&time-zone=-180&sort-column=sd&sort-order=desc&_={int(time.time()*1000)}')
-		return StockbeepApi.breakouts
+		with StockbeepApi.pagesLock:
+			if StockbeepApi.breakouts == None:
+				StockbeepApi.breakouts = self._getJson('stockbeep.com', f'/table-data/range-breakout-stocks?country=us&time-zone=-180&sort-column=sd&sort-order=desc&_={StockbeepApi.requestTime}')
+			return StockbeepApi.breakouts
 
 	def getTrendingStocks(self):
-		if StockbeepApi.trendings == None:
-			StockbeepApi.trendings = self._getJson('stockbeep.com', f'/table-data/trending-stocks?country=us&time-zone=-180&sort-column=sd&sort-order=desc&_={int(time.time()*1000)}')
-		return StockbeepApi.trendings
+		with StockbeepApi.pagesLock:
+			if StockbeepApi.trendings == None:
+				StockbeepApi.trendings = self._getJson('stockbeep.com', f'/table-data/trending-stocks?country=us&time-zone=-180&sort-column=sd&sort-order=desc&_={StockbeepApi.requestTime}')
+			return StockbeepApi.trendings
+
+	def _indexBySymbol(self, data):
+		index = {}
+		for stock in data['data']:
+			# symbol is the text of <a href> tag
+			for symbol in re.findall(r'>([^<>]+)<', stock['sscode']):
+				index[symbol] = stock
+		return index
+
+	def getBreakoutStocksIndex(self):
+		if StockbeepApi.breakoutsIndex == None:
+			StockbeepApi.breakoutsIndex = self._indexBySymbol(self.getBreakoutStocks())
+		return StockbeepApi.breakoutsIndex
+
+	def getTrendingStocksIndex(self):
+		if StockbeepApi.trendingsIndex == None:
+			StockbeepApi.trendingsIndex = self._indexBySymbol(self.getTrendingStocks())
+		return StockbeepApi.trendingsIndex
 
 
 class OpeninsiderApi(HttpApi):
 
-	# global siglethon cache
+	# global siglethon cache, dropped when the day changes
 	lastweekpurchases = None
+	purchases = None
+	purchasesDay = None
+	purchasesParseSeconds = None
+	# the page is checked and fetched under the lock as well, so concurrent tickers download it once
+	purchasesLock = threading.RLock()
+
+	def getLastWeekPurchasesPage(self):
+		with OpeninsiderApi.purchasesLock:
+			if OpeninsiderApi.purchasesDay != datetime.date.today():
+				OpeninsiderApi.lastweekpurchases = None
+				OpeninsiderApi.purchases = None
+				OpeninsiderApi.purchasesDay = datetime.date.today()
+			if OpeninsiderApi.lastweekpurchases == None:
+				OpeninsiderApi.lastweekpurchases = self.request('openinsider.com', '/top-insider-purchases-of-the-week', protocol='http://')
+			return OpeninsiderApi.lastweekpurchases
 
 	def getLastWeekPurchases(self):
-		if OpeninsiderApi.lastweekpurchases == None:
-			OpeninsiderApi.lastweekpurchases = self.request('openinsider.com', '/top-insider-purchases-of-the-week', protocol='http://')
-		soup = BeautifulSoup(OpeninsiderApi.lastweekpurchases, 'lxml')
+		# page is parsed once into {ticker: {money, qty}}, every ticker then does a dict lookup
+		with OpeninsiderApi.purchasesLock:
+			page = self.getLastWeekPurchasesPage()
+			if OpeninsiderApi.purchases is None:
+				started = time.time()
+				OpeninsiderApi.purchases = self._parsePurchases(page)
+				OpeninsiderApi.purchasesParseSeconds = time.time() - started
+			return OpeninsiderApi.purchases
+
+	def _parsePurchases(self, page):
+		soup = BeautifulSoup(page, 'lxml')
 		table = soup.find_all("table", {"class": "tinytable"})
 		tickerStat = {}
 		for record in table[0].find_all("tr"):
@@ -117,30 +493,82 @@ class StonksApi(JsonApi):
 	wsb = None
 	robinhood = None
 	buildId = None
+	# {symbol: item} of the tops above
+	wsbIndex = None
+	robinhoodIndex = None
+	# pages are checked and fetched under the lock, so concurrent tickers download them once
+	pagesLock = threading.RLock()
 
 	def _getBuildId(self):
-		if not StonksApi.buildId:
-			data = str(self.request('stonks.news', ''))
-			import re
-			m = re.search('buildId"\:"(.*?)"', data)
-			if m:
-				StonksApi.buildId = m.group(1)
-		return StonksApi.buildId
+		with StonksApi.pagesLock:
+			if not StonksApi.buildId:
+				data = str(self.request('stonks.news', ''))
+				import re
+				m = re.search('buildId"\:"(.*?)"', data)
+				if m:
+					StonksApi.buildId = m.group(1)
+			return StonksApi.buildId
 
 	def getWSBTop(self):
-		if StonksApi.wsb == None:
-			StonksApi.wsb = self._getJson('stonks.news', f'/_next/data/{self._getBuildId()}/top-100/wall-street-bets.json')
-		return StonksApi.wsb
+		with StonksApi.pagesLock:
+			if StonksApi.wsb == None:
+				StonksApi.wsb = self._getJson('stonks.news', f'/_next/data/{self._getBuildId()}/top-100/wall-street-bets.json')
+			return StonksApi.wsb
 
 	def	getRobinhoodTop(self):
-		if StonksApi.robinhood == None:
-			StonksApi.robinhood = self._getJson('stonks.news', f'/_next/data/{self._getBuildId()}/top-100/robinhood.json')
-		return StonksApi.robinhood
+		with StonksApi.pagesLock:
+			if StonksApi.robinhood == None:
+				StonksApi.robinhood = self._getJson('stonks.news', f'/_next/data/{self._getBuildId()}/top-100/robinhood.json')
+			return StonksApi.robinhood
+
+	def _indexBySymbol(self, data):
+		index = {}
+		if data and 'pageProps' in data and 'items' in data['pageProps']:
+			for stock in data['pageProps']['items']:
+				index[stock['symbol']] = stock
+		return index
+
+	def getWSBTopIndex(self):
+		if StonksApi.wsbIndex == None and self.getWSBTop():
+			StonksApi.wsbIndex = self._indexBySymbol(self.getWSBTop())
+		return StonksApi.wsbIndex or {}
+
+	def getRobinhoodTopIndex(self):
+		if StonksApi.robinhoodIndex == None and self.getRobinhoodTop():
+			StonksApi.robinhoodIndex = self._indexBySymbol(self.getRobinhoodTop())
+		return StonksApi.robinhoodIndex or {}
 
 class TradingviewApi(JsonApi):
 
 	# ta data
 	ta = None
+	# global market-wide index {"exchange:ticker": day columns + week columns}
+	marketTa = None
+	marketPageSize = 2000
+	columns = ["Recommend.Other", "Recommend.All", "Recommend.MA", "Recommend.Other|1W", "Recommend.All|1W", "Recommend.MA|1W"]
+
+	def prefetchMarket(self, tickerNames):
+		# whole scanner page by page, instead of two requests per ticker
+		tickerNames = set(tickerNames)
+		index, start, pages = {}, 0, 0
+		while True:
+			body = json.dumps({
+				"symbols": {"tickers": [], "query": {"types": []}},
+				"columns": TradingviewApi.columns,
+				"sort": {"sortBy": "name", "sortOrder": "asc"},
+				"range": [start, start + TradingviewApi.marketPageSize]
+			})
+			response = self._getJson('scanner.tradingview.com','/america/scan', body = body)
+			pages += 1
+			for item in response['data']:
+				if item['s'].split(':')[1] in tickerNames:
+					index[item['s']] = item['d']
+			start += TradingviewApi.marketPageSize
+			# a short page is the last one, totalCount ends it earlier only when the scanner gives it
+			if len(response['data']) < TradingviewApi.marketPageSize or ('totalCount' in response and start >= response['totalCount']):
+				break
+		TradingviewApi.marketTa = index
+		return pages
 
 	def _getTechnicalAnalysisDataInternal(self, exchangeCode, tickerName, week=False, day=False):
 		suffix = '|1W' if week else ''
@@ -154,8 +582,13 @@ class TradingviewApi(JsonApi):
 
 	def getTechnicalAnalysisData(self, exchangeCode, tickerName):
 		if self.ta is None:
-			responseDay = self._getTechnicalAnalysisDataInternal(exchangeCode, tickerName, day=True)
-			responseWeek = self._getTechnicalAnalysisDataInternal(exchangeCode, tickerName, week=True)
+			row = TradingviewApi.marketTa.get(f"{exchangeCode}:{tickerName}") if TradingviewApi.marketTa is not None else None
+			if row:
+				responseDay, responseWeek = row[:3], row[3:]
+			else:
+				# without the market index, or for a ticker missing from it
+				responseDay = self._getTechnicalAnalysisDataInternal(exchangeCode, tickerName, day=True)
+				responseWeek = self._getTechnicalAnalysisDataInternal(exchangeCode, tickerName, week=True)
 			self.ta = {
 				'day': {'oscillators':responseDay[0],'summary':responseDay[1],'ma':responseDay[2]} if responseDay else None,
 				'week': {'oscillators':responseWeek[0],'summary':responseWeek[1],'ma':responseWeek[2]} if responseWeek else None,
@@ -224,6 +657,7 @@ class WebullApi(JsonApi):
 	responseSearchList = None
 	responseChipQuery = None
 	responseTickerGetTickerRealTime = None
+	responseTickerFinancial = None
 	responseCapitalFlow = None
 	responseSecuritiesAnalysis = None
 	responseShortInterest = None
@@ -254,7 +688,9 @@ class WebullApi(JsonApi):
 		return self.responseTickerGetTickerRealTime
 
 	def getTickerFinancial(self, tickerId):
-		return self._getJson('quotes-gw.webullfintech.com','/api/information/financial/index?tickerId=%s' % (tickerId))
+		if self.responseTickerFinancial == None:
+			self.responseTickerFinancial = self._getJson('quotes-gw.webullfintech.com','/api/information/financial/index?tickerId=%s' % (tickerId))
+		return self.responseTickerFinancial
 
 	def getCapitalFlow(self, tickerId):
 		if self.responseCapitalFlow == None:
@@ -337,6 +773,136 @@ class WebullApi(JsonApi):
 	'''
 
 
+class PendingRequest(Exception):
+
+	def __init__(self, key):
+		super().__init__('response is not downloaded yet')
+		self.key = key
+
+
+class AsyncHttpApi(HttpApi):
+
+	# blocking api code runs unchanged on top of this transport: a response which is not downloaded yet
+	# raises PendingRequest, the event loop downloads it and the call is replayed
+	session = None
+	inflight = {}
+
+	def __init__(self, responses = None):
+		self.responses = {} if responses is None else responses
+
+	def request(self, host, path, headers = {}, body = None, protocol = 'https://'):
+		key = (protocol, host, path, body, tuple(sorted(headers.items())))
+		if key not in self.responses:
+			raise PendingRequest(key)
+		if isinstance(self.responses[key], Exception):
+			raise self.responses[key]
+		return self.responses[key]
+
+	def _getAsyncSession():
+		if AsyncHttpApi.session is None:
+			import aiohttp
+			AsyncHttpApi.session = aiohttp.ClientSession(
+				connector=aiohttp.TCPConnector(limit=0, limit_per_host=HttpApi.hostLimit, ssl=False),
+				timeout=aiohttp.ClientTimeout(sock_connect=HttpApi.connectTimeout, sock_read=HttpApi.readTimeout))
+		return AsyncHttpApi.session
+
+	async def _fetch_internal(key):
+		import aiohttp
+		protocol, host, path, body, headers = key
+		headers = dict(headers, **{'User-Agent': 'okhttp/3.12.1', 'Host': host})
+		session = AsyncHttpApi._getAsyncSession()
+		url = protocol + host + path
+		limiter = HttpApi._getLimiter(host)
+		await limiter.acquireAsync()
+		started, status = time.time(), None
+		try:
+			async with (session.post(url, headers = headers, data = body) if body else session.get(url, headers = headers)) as response:
+				content = await response.read()
+				status = response.status
+		except aiohttp.ClientError as e:
+			# disconnects and broken payloads are not OSError, they are reported as the threads engine reports them
+			raise HostUnavailable(f'{host} failed: {e!r}') from e
+		finally:
+			limiter.release(time.time() - started, status)
+		if HttpApi.cache and status == 200 and content:
+			HttpApi.cache.put(host, path, body, content)
+		return status, content, response.headers.get('Retry-After')
+
+	async def _fetch(key):
+		protocol, host, path, body, headers = key
+		cached = HttpApi.cache.get(host, path, body) if HttpApi.cache else None
+		if cached is not None:
+			return cached
+		breaker = HttpApi._getBreaker(host)
+		if not breaker.allow():
+			raise HostUnavailable(f'{host} circuit is open')
+		for attempt in range(HttpApi.retries + 1):
+			if breaker.state == 'open':
+				raise HostUnavailable(f'{host} circuit is open')
+			try:
+				status, content, retryAfter = await AsyncHttpApi._fetch_internal(key)
+			except Exception:
+				if attempt == HttpApi.retries:
+					breaker.record(False)
+					raise
+				await asyncio.sleep(HostLimiter.getBackoff(attempt))
+				continue
+			overloaded = HostLimiter.isOverloaded(status)
+			if not overloaded or attempt == HttpApi.retries:
+				breaker.record(not overloaded)
+				if overloaded:
+					raise HostUnavailable(f'{host} answered {status}')
+				return content
+			await asyncio.sleep(HostLimiter.getBackoff(attempt, retryAfter))
+
+	async def fetch(key):
+		# tickers asking for the same market-wide page share one download
+		if key not in AsyncHttpApi.inflight:
+			AsyncHttpApi.inflight[key] = asyncio.ensure_future(AsyncHttpApi._fetch(key))
+			AsyncHttpApi.inflight[key].add_done_callback(lambda task: AsyncHttpApi.inflight.pop(key, None))
+		try:
+			return await asyncio.shield(AsyncHttpApi.inflight[key])
+		except Exception as e:
+			return e
+
+	async def close():
+		if AsyncHttpApi.session is not None:
+			await AsyncHttpApi.session.close()
+			AsyncHttpApi.session = None
+
+
+class AsyncJsonApi(AsyncHttpApi, JsonApi):
+	pass
+
+
+class AsyncStockbeepApi(AsyncJsonApi, StockbeepApi):
+	pass
+
+
+class AsyncOpeninsiderApi(AsyncHttpApi, OpeninsiderApi):
+	pass
+
+
+class AsyncStonksApi(AsyncJsonApi, StonksApi):
+	pass
+
+
+class AsyncTradingviewApi(AsyncJsonApi, TradingviewApi):
+	pass
+
+
+class AsyncWallstApi(AsyncJsonApi, WallstApi):
+	pass
+
+
+class AsyncBeststocksApi(AsyncJsonApi, BeststocksApi):
+	pass
+
+
+class AsyncWebullApi(AsyncJsonApi, WebullApi):
+	pass
+
+
 class TickerInfo:
 
 	tickerName = None
@@ -348,9 +914,45 @@ class TickerInfo:
 	wallst_api = None
 	beststocks_api = None
 	tradingview_api = None
-
-	def __init__(self, tickerName):
+	output = None
+	skippedSections = None
+	# failures of a source, rather than of its data, which skip a section until a retry
+	sourceErrors = (HostUnavailable, OSError, asyncio.TimeoutError)
+
+	# sections run in this order: later ones read currentCost, totalShares and exchangeCode filled by fillTickerRealTime
+	sections = [
+		'fillTickerRealTime',
+		'fillTickerFinancials',
+		'fillCostDistribution',
+		'fillCapitalFlow',
+		'fillAnalytics',
+		'fillShortInterest',
+		#'fillInstitution',
+		'fillGuess',
+		'fillTrend',
+		'fillSectors',
+		'fillOptions',
+		'fillTechnicalAnal',
+		'fillInsiderPurchases',
+		'fillDividendInfo',
+		'fillWallstAnalytics',
+		'fillBeststocksAnalytics',
+		'fillSettings',
+	]
+	# sections reading what a section fills, they ran without it when the section was skipped
+	dependents = {
+		'fillTickerRealTime': ['fillCostDistribution', 'fillAnalytics', 'fillShortInterest', 'fillOptions', 'fillTechnicalAnal', 'fillInsiderPurchases', 'fillDividendInfo'],
+	}
+
+	# shared pool for prefetching responses of all tickers being collected
+	fetchWorkers = 32
+	fetchPool = None
+	fetchPoolLock = threading.Lock()
+
+	def __init__(self, tickerName, output = None):
 		self.tickerName = tickerName
+		self.output = output
+		self.skippedSections = []
 		self.webull_api = WebullApi()
 		self.stockbeep_api = StockbeepApi()
 		self.openinsider_api = OpeninsiderApi()
@@ -368,11 +970,22 @@ class TickerInfo:
 				return None
 		return tmpObj
 
-	def _callWithException(self, func):
+	def _log(self, message):
+		# concurrent crawls buffer their messages to print them in ticker order
+		if self.output is None:
+			print(message)
+		else:
+			self.output.append(message)
+
+	def _callWithException(self, func, section = None):
 		try:
 			func()
+		except TickerInfo.sourceErrors as e:
+			# source failures, unlike data errors, are worth a retry of the section later
+			self.skippedSections.append(section)
+			self._log(f"Skipped | {section}: {type(e).__name__} {e}")
 		except Exception as e:
-			print(f"{type(e).__name__} | {e}:{e.__traceback__.tb_next.tb_next.tb_lineno}")
+			self._log(f"{type(e).__name__} | {e}:{e.__traceback__.tb_next.tb_next.tb_lineno}")
 
 	def loadInternal(self):
 		webullTickerName = self.tickerName.replace('.',' ') # webull interprets "." as " "
@@ -387,7 +1000,7 @@ class TickerInfo:
 			raise Exception('ticker not found')
 
 	def load(self):
-		self._callWithException(lambda: self.loadInternal())
+		self._callWithException(lambda: self.loadInternal(), 'load')
 		return self.tickerId
 
 	def fillCostDistribution(self, info):
@@ -741,36 +1354,28 @@ class TickerInfo:
 				'bullRatio': data['guessCountInfo']['bullPct'] / 100.0 if data['guessCountInfo']['bullNum']>0 else None
 			}
 		# wsb
-		data = self.stonks_api.getWSBTop()
-		if data and 'pageProps' in data and 'items' in data['pageProps']:
-			for stock in data['pageProps']['items']:
-				if stock['symbol'] == self.tickerName:
-					info['social_guess']['wsb'] = {
-						'mentions': stock['count'] if 'count' in stock else -1, 
-						'popularity': stock['popularity'] if 'popularity' in stock else -1
-					}
+		stock = self.stonks_api.getWSBTopIndex().get(self.tickerName)
+		if stock:
+			info['social_guess']['wsb'] = {
+				'mentions': stock['count'] if 'count' in stock else -1, 
+				'popularity': stock['popularity'] if 'popularity' in stock else -1
+			}
 		# robinhood
-		data = self.stonks_api.getRobinhoodTop()
-		if data and 'pageProps' in data and 'items' in data['pageProps']:
-			for stock in data['pageProps']['items']:
-				if stock['symbol'] == self.tickerName:
-					info['social_guess']['robinhood'] = {
-						'rank': stock['basetable_id'] if 'basetable_id' in stock else -1
-					}
+		stock = self.stonks_api.getRobinhoodTopIndex().get(self.tickerName)
+		if stock:
+			info['social_guess']['robinhood'] = {
+				'rank': stock['basetable_id'] if 'basetable_id' in stock else -1
+			}
 
 	def fillTechnicalAnal(self, info):
 		# breakouts
-		data = self.stockbeep_api.getBreakoutStocks()
+		breakouts = self.stockbeep_api.getBreakoutStocksIndex()
 		info['technical'] = {}
-		for stock in data['data']:
-			# <a href> tag parse
-			if f">{self.tickerName}<" in stock['sscode']:
-				info['technical']['breakout_magnitude'] = float(stock['sd']) # resistance for latest 5 day 
-		data = self.stockbeep_api.getTrendingStocks()
-		for stock in data['data']:
-			# <a href> tag parse
-			if f">{self.tickerName}<" in stock['sscode']:
-				info['technical']['trend_comment'] = stock['sscomment'] 
+		if self.tickerName in breakouts:
+			info['technical']['breakout_magnitude'] = float(breakouts[self.tickerName]['sd']) # resistance for latest 5 day 
+		trendings = self.stockbeep_api.getTrendingStocksIndex()
+		if self.tickerName in trendings:
+			info['technical']['trend_comment'] = trendings[self.tickerName]['sscomment'] 
 		# technical analysis
 		info['technical']['ta'] = self.tradingview_api.getTechnicalAnalysisData(info['exchangeCode'], self.tickerName)
 
@@ -858,8 +1463,10 @@ class TickerInfo:
 				'fundamental': fullStats['analysis']['fundamentalsReturnOnEquity'],
 				'putCallRatio': fullStats['statistic']['putCallRatio']
 			}
+		except TickerInfo.sourceErrors:
+			raise
 		except:
-			print("Exception | fillBeststocksAnalytics: could not extract full stats from beststocks")
+			self._log("Exception | fillBeststocksAnalytics: could not extract full stats from beststocks")
 		### investors
 		try:
 			investorStats = self.beststocks_api.getInvestorStats(self.tickerName)
@@ -877,8 +1484,10 @@ class TickerInfo:
 				'holdingPortfolios': investorStats['investorStatsOverview']['portfoliosHoldingStock'] / (investorStats['investorStatsOverview']['numberOfPortfolios'] or 1),
 				'attitude': investorStats['investorStatsOverview']['sentiment']
 			}
+		except TickerInfo.sourceErrors:
+			raise
 		except:
-			print("Exception | fillBeststocksAnalytics: could not extract investors stats from beststocks")
+			self._log("Exception | fillBeststocksAnalytics: could not extract investors stats from beststocks")
 		### news
 		newsStats = self.beststocks_api.getNewsStats(self.tickerName)
 		info['beststocksAnalytics']['news'] = {
@@ -894,51 +1503,341 @@ class TickerInfo:
 			'wallstIdentity': self.wallst_api.getIdentityByTicker(self.tickerName)
 		}
 
-	def collect(self):
-		info = {}
-		self._callWithException(lambda: self.fillTickerRealTime(info))
-		self._callWithException(lambda: self.fillTickerFinancials(info))
-		self._callWithException(lambda: self.fillCostDistribution(info))
-		self._callWithException(lambda: self.fillCapitalFlow(info))
-		self._callWithException(lambda: self.fillAnalytics(info))
-		self._callWithException(lambda: self.fillShortInterest(info))
-		#self._callWithException(lambda: self.fillInstitution(info))
-		self._callWithException(lambda: self.fillGuess(info))
-		self._callWithException(lambda: self.fillTrend(info))
-		self._callWithException(lambda: self.fillSectors(info))
-		self._callWithException(lambda: self.fillOptions(info))
-		self._callWithException(lambda: self.fillTechnicalAnal(info))
-		self._callWithException(lambda: self.fillInsiderPurchases(info))
-		self._callWithException(lambda: self.fillDividendInfo(info))
-		self._callWithException(lambda: self.fillWallstAnalytics(info))
-		self._callWithException(lambda: self.fillBeststocksAnalytics(info))
-		self._callWithException(lambda: self.fillSettings(info))
+	def _getFetchPool():
+		with TickerInfo.fetchPoolLock:
+			if TickerInfo.fetchPool is None:
+				TickerInfo.fetchPool = concurrent.futures.ThreadPoolExecutor(max_workers=TickerInfo.fetchWorkers)
+			return TickerInfo.fetchPool
+
+	def _prefetchChains(self, sections = None):
+		# independent request chains, each one warms the api caches read by the fill* sections it is listed with,
+		# only the chains of the given sections when some are given
+		tickerId = self.tickerId
+		endDate = datetime.datetime.now()
+		startDate = (endDate - datetime.timedelta(days=7))
+		chains = [
+			(('fillTickerRealTime', 'fillTechnicalAnal'), lambda: self.tradingview_api.getTechnicalAnalysisData(self.webull_api.getTickerGetTickerRealTime(tickerId)['disExchangeCode'], self.tickerName)),
+			(('fillTickerFinancials',), lambda: self.webull_api.getTickerFinancial(tickerId)),
+			(('fillCostDistribution',), lambda: self.webull_api.getChipQuery(tickerId, startDate.strftime('%Y-%m-%d'), endDate.strftime('%Y-%m-%d'))),
+			(('fillCapitalFlow',), lambda: self.webull_api.getCapitalFlow(tickerId)),
+			(('fillAnalytics',), lambda: self.webull_api.getSecuritiesAnalysis(tickerId)),
+			(('fillShortInterest',), lambda: self.webull_api.getShortInterest(tickerId)),
+			(('fillGuess',), lambda: self.webull_api.getGuess(tickerId)),
+			(('fillTrend',), lambda: self.webull_api.getTickerTrendLastYear(tickerId)),
+			(('fillTrend',), lambda: self.webull_api.getTickerTrendFiveYear(tickerId)),
+			(('fillSectors',), lambda: self.webull_api.getBriefInfo(tickerId)),
+			(('fillOptions',), lambda: self.webull_api.getOptions(tickerId)),
+			(('fillInsiderPurchases',), lambda: self.webull_api.getInsiderInfo(tickerId)),
+			(('fillGuess',), lambda: (self.stonks_api.getWSBTop(), self.stonks_api.getRobinhoodTop())),
+			(('fillTechnicalAnal',), lambda: self.stockbeep_api.getBreakoutStocks()),
+			(('fillTechnicalAnal',), lambda: self.stockbeep_api.getTrendingStocks()),
+			(('fillInsiderPurchases',), lambda: self.openinsider_api.getLastWeekPurchasesPage()),
+			(('fillDividendInfo', 'fillWallstAnalytics', 'fillSettings'), lambda: self.wallst_api.getFullData(self.tickerName)),
+			(('fillBeststocksAnalytics',), lambda: self.beststocks_api.getFullStats(self.tickerName)),
+			(('fillBeststocksAnalytics',), lambda: self.beststocks_api.getInvestorStats(self.tickerName)),
+			(('fillBeststocksAnalytics',), lambda: self.beststocks_api.getNewsStats(self.tickerName)),
+		]
+		return [chain for chainSections, chain in chains if sections is None or set(chainSections) & set(sections)]
+
+	def prefetch(self, sections = None):
+		# errors are left to the sections: a failed chain is simply requested again there
+		pool = TickerInfo._getFetchPool()
+		concurrent.futures.wait([pool.submit(chain) for chain in self._prefetchChains(sections)])
+
+	def getRetrySections(skippedSections):
+		# skipped sections and the sections which read what they fill, in the order sections run
+		sections = set(skippedSections)
+		for section in skippedSections:
+			sections.update(TickerInfo.dependents.get(section, ()))
+		return [section for section in TickerInfo.sections if section in sections]
+
+	def collect(self, sections = None, info = None):
+		# a retry of a partially collected ticker runs only its skipped sections over the stored document
+		info = {} if info is None else info
+		self.prefetch(sections)
+		for section in sections or TickerInfo.sections:
+			self._callWithException(lambda: getattr(self, section)(info), section)
+		if self.skippedSections:
+			# sections of sources which were down, instead of paying timeouts for them
+			info.setdefault('_', {})['skippedSections'] = self.skippedSections
+		elif '_' in info:
+			info['_'].pop('skippedSections', None)
 		return info
 
 
-class Storage:
+class AsyncTickerInfo(TickerInfo):
 
-	def __init__(self):
-		self.client = pymongo.MongoClient('localhost', 27017)
-		self.db = self.client.webull
-		collectionName = datetime.datetime.now().strftime('tickers_%Y_%m_%d')
-		self.collection = self.db[collectionName]
-		self.collection.create_index("ticker", unique=True)
+	def __init__(self, tickerName, output = None):
+		self.tickerName = tickerName
+		self.output = output
+		self.skippedSections = []
+		self.responses = {}
+		self.webull_api = AsyncWebullApi(self.responses)
+		self.stockbeep_api = AsyncStockbeepApi(self.responses)
+		self.openinsider_api = AsyncOpeninsiderApi(self.responses)
+		self.stonks_api = AsyncStonksApi(self.responses)
+		self.wallst_api = AsyncWallstApi(self.responses)
+		self.beststocks_api = AsyncBeststocksApi(self.responses)
+		self.tradingview_api = AsyncTradingviewApi(self.responses)
+
+	async def _drive(self, func):
+		while True:
+			try:
+				return func()
+			except PendingRequest as pending:
+				self.responses[pending.key] = await AsyncHttpApi.fetch(pending.key)
 
-	def insert(self, ticker, jsonData):
-		jsonData["ticker"] = ticker
-		self.collection.update_one(
-			{"ticker": ticker},
-			{"$set":jsonData},
-			upsert=True)
+	async def loadAsync(self):
+		# errors are reported by the blocking replay, which reads already downloaded responses only
+		try:
+			await self._drive(self.loadInternal)
+		except Exception:
+			pass
+		return self.load()
 
-	def contains(self, ticker):
-		return self.collection.find_one({"ticker":ticker}) is not None
+	async def collectAsync(self, sections = None, info = None):
+		await asyncio.gather(*[self._drive(chain) for chain in self._prefetchChains(sections)], return_exceptions=True)
+		return self.collect(sections, info)
+
+	def prefetch(self, sections = None):
+		# responses are downloaded by collectAsync
+		pass
+
+
+class Storage:
+
+	# documents are buffered and upserted by one unordered bulk write per batch, flushed by size or age
+	batchSize = 100
+	maxAge = 5
+
+	def __init__(self, dbName = 'webull', host = 'localhost', day = None):
+		self.client = pymongo.MongoClient(host, 27017)
+		self.db = self.client[dbName]
+		self.day = day or datetime.datetime.now().strftime('%Y_%m_%d')
+		self.collection = self.db['tickers_' + self.day]
+		self.collection.create_index("ticker", unique=True)
+		self.tickers = None
+		self.buffer = []
+		self.bufferStarted = None
+		self.bufferLock = threading.Lock()
+		# called with the tags of every flushed batch, after its documents are written,
+		# and with the tags of documents the database rejected, which are never written
+		self.onFlush = None
+		self.onReject = None
+		self.flushes = []
+		self.errors = []
+
+	def insert(self, ticker, jsonData, tag = None):
+		# jsonData None writes nothing, but its tag is still reported in order with the flush
+		if jsonData is not None:
+			jsonData["ticker"] = ticker
+		with self.bufferLock:
+			if self.tickers is not None and jsonData is not None:
+				self.tickers.add(ticker)
+			if not self.buffer:
+				self.bufferStarted = time.time()
+			self.buffer.append((ticker, jsonData, tag))
+			batch = self._takeBatch(False)
+		self._write(batch)
+
+	def _takeBatch(self, force):
+		if not self.buffer or not (force or len(self.buffer) >= Storage.batchSize or time.time() - self.bufferStarted >= Storage.maxAge):
+			return []
+		batch, self.buffer = self.buffer, []
+		return batch
+
+	def flush(self, force = True):
+		with self.bufferLock:
+			batch = self._takeBatch(force)
+		self._write(batch)
+
+	def _write(self, batch):
+		if not batch:
+			return
+		started = time.time()
+		written = [entry for entry in batch if entry[1] is not None]
+		rejected = set()
+		try:
+			if written:
+				self.collection.bulk_write([pymongo.UpdateOne({"ticker": ticker}, {"$set": jsonData}, upsert=True) for ticker, jsonData, _ in written], ordered=False)
+		except pymongo.errors.BulkWriteError as e:
+			# the other documents of an unordered batch are written
+			rejected = {error['index'] for error in e.details['writeErrors']}
+			self._addError(e)
+		except Exception as e:
+			# the batch goes back to the buffer to be written by a later flush, its tickers stay unfinished until then
+			self._addError(e)
+			with self.bufferLock:
+				self.buffer = batch + self.buffer
+				self.bufferStarted = started
+			return
+		with self.bufferLock:
+			self.flushes.append((len(written) - len(rejected), time.time() - started))
+		rejectedTickers = {written[index][0] for index in rejected}
+		if self.onReject and rejected:
+			self.onReject([tag for ticker, _, tag in batch if tag is not None and ticker in rejectedTickers])
+		if self.onFlush:
+			self.onFlush([tag for ticker, _, tag in batch if tag is not None and ticker not in rejectedTickers])
+
+	def _addError(self, error):
+		with self.bufferLock:
+			self.errors.append(f"{type(error).__name__} {error}")
+
+	def printStats(self):
+		if self.errors:
+			print(f"Storage | {len(self.errors)} bulk writes failed, last: {self.errors[-1]}")
+		if not self.flushes:
+			return
+		sizes, latencies = zip(*self.flushes)
+		print(f"Storage | {sum(sizes)} documents in {len(self.flushes)} bulk writes, batch {round(numpy.mean(sizes), 1)} avg {max(sizes)} max, "
+			f"flush {round(numpy.mean(latencies), 3)}s avg {round(numpy.percentile(latencies, 95), 3)}s p95 {round(max(latencies), 3)}s max")
+
+	def export(self, directory):
+		# columnar copy of the day for the analyzer, see snapshot.py, pyarrow is loaded by the export only
+		import snapshot
+		os.makedirs(directory, exist_ok=True)
+		filename = os.path.join(directory, self.collection.name + '.arrow')
+		started = time.time()
+		snapshot.export(self.collection.find({}, {'_id': 0}), filename)
+		print(f"Export | {filename}: {round(os.path.getsize(filename) / 2**20, 1)} MB in {round(time.time() - started, 2)}s")
+
+	def get(self, ticker):
+		return self.collection.find_one({"ticker":ticker}, {"_id": 0})
+
+	def getTickers(self):
+		# tickers already stored today, loaded once by a single projected query and kept up to date by insert
+		with self.bufferLock:
+			if self.tickers is None:
+				self.tickers = {document["ticker"] for document in self.collection.find({}, {"ticker": 1, "_id": 0})}
+			return self.tickers
+
+
+class WorkQueue:
+
+	# durable queue of a daily crawl run, shared by all crawling nodes: pending -> inflight (leased) -> done | failed,
+	# failed items and leases expired with their dead owner are claimed again until the attempts are exhausted
+	leaseSeconds = 120
+	heartbeatSeconds = 30
+	retryDelay = 60
+	maxAttempts = 3
+
+	def __init__(self, db, day):
+		self.collection = db['queue_' + day]
+		# pending items by order, failed and expired items by lease, leased ones by the claim token
+		self.collection.create_index([("state", 1), ("order", 1)])
+		self.collection.create_index([("state", 1), ("leaseUntil", 1)])
+		self.collection.create_index([("claim", 1)])
+		self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+	def isSeeded(self):
+		return self.collection.find_one({"_id": "_meta"}) is not None
+
+	def seed(self, tickers, doneTickers):
+		items = [{
+			"_id": ticker,
+			"order": order,
+			"state": "done" if ticker in doneTickers else "pending",
+			"attempts": 0,
+			"leaseUntil": 0,
+			"failedSections": None
+		} for order, ticker in enumerate(tickers)]
+		try:
+			self.collection.insert_many(items, ordered=False)
+		except pymongo.errors.BulkWriteError:
+			pass # items of an interrupted seeding are kept as they are
+		self.collection.update_one({"_id": "_meta"}, {"$set": {"state": "meta", "total": len(tickers), "seeded": time.time()}}, upsert=True)
+
+	def getTickers(self):
+		return [item["_id"] for item in self.collection.find({"state": {"$ne": "meta"}}, {"_id": 1}).sort("order")]
+
+	def _claimable(self, now):
+		return {"$or": [
+			{"state": "pending"},
+			{"state": {"$in": ["inflight", "failed"]}, "leaseUntil": {"$lt": now}, "attempts": {"$lt": WorkQueue.maxAttempts}}
+		]}
+
+	def _expire(self, now):
+		# an expired lease without attempts left, its owner died on the last attempt, is failed for good
+		self.collection.update_many(
+			{"state": "inflight", "leaseUntil": {"$lt": now}, "attempts": {"$gte": WorkQueue.maxAttempts}},
+			{"$set": {"state": "failed", "owner": None}})
+
+	def claim(self, count):
+		# candidates are leased with a single update, the claim token tells which of them this node actually got
+		self._expire(time.time())
+		while True:
+			now = time.time()
+			ids = [item["_id"] for item in self.collection.find(self._claimable(now), {"_id": 1}).sort("order").limit(count)]
+			if not ids:
+				return []
+			token = uuid.uuid4().hex
+			self.collection.update_many(
+				{"_id": {"$in": ids}, **self._claimable(now)},
+				{"$set": {"state": "inflight", "owner": self.owner, "claim": token, "leaseUntil": now + WorkQueue.leaseSeconds}, "$inc": {"attempts": 1}})
+			items = list(self.collection.find({"claim": token}).sort("order"))
+			if items:
+				return items
+			# all candidates were taken by other nodes in between
+
+	def _finishUpdate(self, item, failed, failedSections):
+		# failedSections None retries the whole ticker
+		if not failed:
+			return pymongo.UpdateOne(
+				{"_id": item["_id"], "claim": item["claim"]},
+				{"$set": {"state": "done", "failedSections": None}})
+		return pymongo.UpdateOne(
+			{"_id": item["_id"], "claim": item["claim"]},
+			{"$set": {"state": "failed", "failedSections": failedSections, "leaseUntil": time.time() + WorkQueue.retryDelay}})
+
+	def finish(self, results):
+		# results are (item, failed, failedSections), finished by one bulk write
+		if results:
+			self.collection.bulk_write([self._finishUpdate(*result) for result in results], ordered=False)
+
+	def complete(self, item):
+		self.finish([(item, False, None)])
+
+	def fail(self, item, failedSections):
+		self.finish([(item, True, failedSections)])
+
+	def heartbeat(self):
+		self.collection.update_many(
+			{"state": "inflight", "owner": self.owner},
+			{"$set": {"leaseUntil": time.time() + WorkQueue.leaseSeconds}})
+
+	def release(self):
+		# unfinished tickers of a stopping node go back to the queue without spending an attempt
+		self.collection.update_many(
+			{"state": "inflight", "owner": self.owner},
+			{"$set": {"state": "pending", "leaseUntil": 0}, "$inc": {"attempts": -1}})
+
+	def getRetryDelay(self):
+		# seconds until a failed or expired item can be claimed again, None when nothing is left to retry,
+		# tickers leased by other nodes are waited for as their node may die before finishing them
+		self._expire(time.time())
+		item = self.collection.find_one(
+			{"state": {"$in": ["inflight", "failed"]}, "attempts": {"$lt": WorkQueue.maxAttempts}},
+			sort=[("leaseUntil", 1)])
+		return max(0, item["leaseUntil"] - time.time()) if item else None
+
+	def getStats(self):
+		stats = {"pending": 0, "inflight": 0, "done": 0, "failed": 0}
+		for group in self.collection.aggregate([{"$match": {"state": {"$ne": "meta"}}}, {"$group": {"_id": "$state", "count": {"$sum": 1}}}]):
+			stats[group["_id"]] = group["count"]
+		return stats
 
 
 class Crawler:
 
 	storage = None
+	queue = None
+	tickerInfoClass = TickerInfo
+	# directory of the columnar export of a finished day, None to skip it
+	exportDir = None
+
+	def __init__(self, dbName = 'webull', mongoHost = 'localhost'):
+		self.dbName = dbName
+		self.mongoHost = mongoHost
 
 	def enumerateTickers(self, token):
 		stocks = TinkoffApi().tinkoffGetMarketStocks(token)
@@ -954,30 +1853,174 @@ class Crawler:
 
 	def getStorage(self):
 		if not self.storage:
-			self.storage = Storage()
+			self.storage = Storage(self.dbName, self.mongoHost)
 		return self.storage
 
-	def crawlTicker(self, tickerName):
-		ticker = TickerInfo(tickerName)
+	def getQueue(self):
+		if not self.queue:
+			self.queue = WorkQueue(self.getStorage().db, self.getStorage().day)
+		return self.queue
+
+	def crawlTicker(self, tickerName, output = None):
+		ticker = TickerInfo(tickerName, output)
 		return ticker.collect() if ticker.load() else None
 
-	def crawlTickersDaily(self, token):
-		tickers = self.enumerateTickers(token)
-		progress = 0
+	def _getRetry(self, item):
+		# sections skipped by a previous attempt and the stored document they are merged into
+		info = self.getStorage().get(item['_id']) if item['failedSections'] else None
+		return (TickerInfo.getRetrySections(item['failedSections']), info) if info else (None, None)
+
+	def _finishItem(self, item, ticker, info, output):
+		# the queue item is finished with the flush of its document, so a crash never marks an unwritten ticker done
+		failed = bool(ticker.skippedSections)
+		sections = None if 'load' in ticker.skippedSections else ticker.skippedSections
+		self.getStorage().insert(item['_id'], info or None, (item, failed, sections))
+		if failed:
+			output.append(f"Retry | {len(sections) if sections else 'all'} sections, attempt {item['attempts']} of {WorkQueue.maxAttempts}")
+
+	def _crawlItem(self, item):
+		output = []
+		try:
+			ticker = self.tickerInfoClass(item['_id'], output)
+			sections, info = self._getRetry(item)
+			info = ticker.collect(sections, info) if ticker.load() else None
+			self._finishItem(item, ticker, info, output)
+		except Exception as e:
+			output.append("Error | " + str(e))
+			self.getQueue().fail(item, item['failedSections'])
+		return output
+
+	async def _crawlItemAsync(self, item, slots):
+		async with slots:
+			output = []
+			try:
+				ticker = AsyncTickerInfo(item['_id'], output)
+				sections, info = self._getRetry(item)
+				info = await ticker.collectAsync(sections, info) if await ticker.loadAsync() else None
+				self._finishItem(item, ticker, info, output)
+			except Exception as e:
+				output.append("Error | " + str(e))
+				self.getQueue().fail(item, item['failedSections'])
+			return output
+
+	def _printProgress(self, progress, total, tickerName, output, retry = False):
+		HttpApi.printMessages()
+		print("Ticker = " + tickerName + " [%s%%]"%(str(round(progress/float(total) * 100, 2))) + (" retry" if retry else ""))
+		for message in output:
+			print(message)
+
+	def _crawlQueue(self, workers, progress, total):
+		# a window of claimed tickers is kept ahead of the workers, progress is printed in claim order,
+		# a ticker crawled again is printed as a retry and counted once
+		queue = self.getQueue()
+		window = collections.deque()
+		crawled = set()
+		with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+			try:
+				while True:
+					if len(window) <= workers:
+						for item in queue.claim(2 * workers - len(window)):
+							window.append((item, executor.submit(self._crawlItem, item)))
+					if window:
+						item, future = window.popleft()
+						retry = item['_id'] in crawled
+						crawled.add(item['_id'])
+						self._printProgress(progress, total, item['_id'], future.result(), retry)
+						progress += 0 if retry else 1
+						continue
+					self.getStorage().flush()
+					delay = queue.getRetryDelay()
+					if delay is None:
+						break
+					time.sleep(min(delay, WorkQueue.heartbeatSeconds))
+			except BaseException:
+				# a stopping node waits for the running tickers only, the others are released to the queue
+				for item, future in window:
+					future.cancel()
+				raise
+
+	async def _crawlQueueAsync(self, workers, progress, total):
+		queue = self.getQueue()
+		slots = asyncio.Semaphore(workers)
+		window = collections.deque()
+		crawled = set()
+		try:
+			while True:
+				if len(window) <= workers:
+					for item in queue.claim(2 * workers - len(window)):
+						window.append((item, asyncio.ensure_future(self._crawlItemAsync(item, slots))))
+				if window:
+					item, task = window.popleft()
+					retry = item['_id'] in crawled
+					crawled.add(item['_id'])
+					self._printProgress(progress, total, item['_id'], await task, retry)
+					progress += 0 if retry else 1
+					continue
+				self.getStorage().flush()
+				delay = queue.getRetryDelay()
+				if delay is None:
+					break
+				await asyncio.sleep(min(delay, WorkQueue.heartbeatSeconds))
+		finally:
+			await AsyncHttpApi.close()
+
+	def prefetchMarket(self, tickers):
+		# market-wide data shared by all tickers, failed prefetch falls back to per ticker requests
+		try:
+			started = time.time()
+			pages = TradingviewApi().prefetchMarket(tickers)
+			print(f"TradingView | {len(TradingviewApi.marketTa)} tickers prefetched in {pages} requests, {round(time.time()-started, 2)}s")
+		except Exception as e:
+			print(f"TradingView | market prefetch failed: {type(e).__name__} {e}")
+
+	def printStats(self):
+		HttpApi.printPoolStats()
+		if self.storage:
+			self.storage.printStats()
+		if HttpApi.cache:
+			HttpApi.cache.printStats()
+		if OpeninsiderApi.purchases is not None:
+			print(f"Openinsider | {len(OpeninsiderApi.purchases)} tickers parsed once in {round(OpeninsiderApi.purchasesParseSeconds, 3)}s")
+
+	def _heartbeat(self, stopped):
+		# leases are extended while this node is alive, tickers of a dead node are claimed by others once they expire
+		while not stopped.wait(WorkQueue.heartbeatSeconds):
+			try:
+				self.getQueue().heartbeat()
+				# a batch older than Storage.maxAge is written even when no ticker is inserted
+				self.getStorage().flush(False)
+			except Exception as e:
+				print(f"Queue | heartbeat failed: {type(e).__name__} {e}")
+
+	def crawlTickersDaily(self, token, workers = 1, engine = 'threads'):
+		queue = self.getQueue()
+		if not queue.isSeeded():
+			# the universe is enumerated once a day, a resumed run continues the stored queue
+			queue.seed(self.enumerateTickers(token), self.getStorage().getTickers())
+		tickers = queue.getTickers()
 		total = len(tickers)
 		print ("Total = " + str(total))
-		for tickerName in tickers:
-			print("Ticker = " + tickerName + " [%s%%]"%(str(round(progress/float(total) * 100, 2))))
-			if not self.getStorage().contains(tickerName):	
-				try:
-					info = self.crawlTicker(tickerName)
-					if info:
-						self.getStorage().insert(tickerName, info)
-				except Exception as e:
-					print("Error | " + str(e))
+		self.prefetchMarket(tickers)
+		progress = queue.getStats()['done']
+		self.getStorage().onFlush = queue.finish
+		# a document the database rejects is crawled again as a whole
+		self.getStorage().onReject = lambda results: queue.finish([(item, True, None) for item, _, _ in results])
+		stopped = threading.Event()
+		threading.Thread(target=self._heartbeat, args=(stopped,), daemon=True).start()
+		try:
+			if engine == 'async':
+				# one event loop keeps up to `workers` tickers, and all of their requests, in flight
+				asyncio.run(self._crawlQueueAsync(workers, progress, total))
 			else:
-				print('already exists in storage')
-			progress += 1
+				self._crawlQueue(workers, progress, total)
+		finally:
+			stopped.set()
+			self.getStorage().flush()
+			queue.release()
+		stats = queue.getStats()
+		print(f"Queue | {stats['done']} done, {stats['failed']} failed, {stats['inflight']} inflight, {stats['pending']} pending")
+		if self.exportDir and not stats['inflight'] and not stats['pending']:
+			self.getStorage().export(self.exportDir)
 
 
 class UserInterface:
@@ -987,17 +2030,51 @@ class UserInterface:
 		subparsers = parser.add_subparsers(dest="command", help='Commands')
 		crawl = subparsers.add_parser('crawl', help='Crawl all tickers to DB')
 		crawl.add_argument('token', help='Tinkoff auth token')
+		crawl.add_argument('--workers', dest='workers', type=int, default=1, help='Tickers crawled concurrently')
+		crawl.add_argument('--engine', dest='engine', choices=['threads', 'async'], default='threads', help='Blocking thread pool or single asyncio event loop')
+		crawl.add_argument('--db', dest='db', default='webull', help='MongoDB database, shared by all crawling nodes')
+		crawl.add_argument('--mongo-host', dest='mongoHost', default='localhost', help='MongoDB host, shared by all crawling nodes')
+		crawl.add_argument('--max-attempts', dest='maxAttempts', type=int, default=None, help='Attempts of a failed ticker before it is given up for the day')
+		crawl.add_argument('--export-dir', dest='exportDir', default='snapshots', help='Directory of columnar day files for the analyzer, exported once the day is crawled')
+		crawl.add_argument('--no-export', dest='noexport', action='store_true', default=False, help='Do not export the crawled day')
+		self._addHttpArguments(crawl)
+		export = subparsers.add_parser('export', help='Export crawled days to columnar files, the days not exported yet by default')
+		export.add_argument('--date', dest='date', default=None, help='Day to export, YYYY-MM-DD')
+		export.add_argument('--force', dest='force', action='store_true', default=False, help='Export days already exported again')
+		export.add_argument('--export-dir', dest='exportDir', default='snapshots', help='Directory of columnar day files')
+		export.add_argument('--db', dest='db', default='webull', help='MongoDB database')
+		export.add_argument('--mongo-host', dest='mongoHost', default='localhost', help='MongoDB host')
 		ticker = subparsers.add_parser('ticker', help='Crawls single ticker and prints')
 		ticker.add_argument('ticker', help='Ticker')
+		self._addHttpArguments(ticker)
 		webull_feed = subparsers.add_parser('webull_feed', help='Webull feed by ticker')
 		webull_feed.add_argument('ticker', help='Ticker')
 		webull_feedComments = subparsers.add_parser('webull_comments', help='Webull feed comments by uuid')
 		webull_feedComments.add_argument('id', help='ID of feed item')
 		self.args = parser.parse_args()
 
+	def _addHttpArguments(self, parser):
+		parser.add_argument('--pool-size', dest='poolSize', type=int, default=None, help='Keep-alive connections kept per host')
+		parser.add_argument('--connect-timeout', dest='connectTimeout', type=float, default=None, help='HTTP connect timeout, seconds')
+		parser.add_argument('--read-timeout', dest='readTimeout', type=float, default=None, help='HTTP read timeout, seconds')
+		parser.add_argument('--host-limit', dest='hostLimit', type=int, default=None, help='Max concurrent requests per host, adapts below it')
+		parser.add_argument('--host-rate', dest='hostRate', type=float, default=None, help='Max requests per second per host, adapts below it')
+		parser.add_argument('--fetch-workers', dest='fetchWorkers', type=int, default=None, help='Requests of collected tickers prefetched concurrently')
+		parser.add_argument('--http-cache', dest='httpCache', default='http_cache.sqlite', help='On-disk cache of slowly changing responses')
+		parser.add_argument('--http-cache-size', dest='httpCacheSize', type=int, default=512, help='On-disk cache limit, MB')
+		parser.add_argument('--no-http-cache', dest='nohttpcache', action='store_true', default=False, help='Always download responses')
+
 	def go(self):
+		if self.args.command in ('crawl', 'ticker'):
+			HttpApi.configure(self.args.poolSize, self.args.connectTimeout, self.args.readTimeout, self.args.hostLimit, self.args.hostRate)
+			TickerInfo.fetchWorkers = self.args.fetchWorkers or TickerInfo.fetchWorkers
+			if not self.args.nohttpcache:
+				HttpApi.cache = ResponseCache(self.args.httpCache, self.args.httpCacheSize * 2**20)
 		if self.args.command == 'crawl':
-			self.runCrawler(self.args.token)
+			WorkQueue.maxAttempts = self.args.maxAttempts or WorkQueue.maxAttempts
+			self.runCrawler(self.args.token, self.args.workers, self.args.engine, self.args.db, self.args.mongoHost, None if self.args.noexport else self.args.exportDir)
+		elif self.args.command == 'export':
+			self.exportDays(self.args.db, self.args.mongoHost, self.args.exportDir, self.args.date, self.args.force)
 		elif self.args.command == 'ticker':
 			self.hitTicker(self.args.ticker)
 		elif self.args.command == 'webull_feed':
@@ -1005,13 +2082,34 @@ class UserInterface:
 		elif self.args.command == 'webull_comments':
 			self.printFeedItemComments(self.args.id)
 
-	def runCrawler(self, token):
-		crawler = Crawler()
-		crawler.crawlTickersDaily(token)
+	def runCrawler(self, token, workers, engine, dbName, mongoHost, exportDir):
+		# a terminated node gives its leases back on the way out
+		signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+		crawler = Crawler(dbName, mongoHost)
+		crawler.exportDir = exportDir
+		crawler.crawlTickersDaily(token, workers, engine)
+		crawler.printStats()
+
+	def exportDays(self, dbName, mongoHost, directory, date, force):
+		db = pymongo.MongoClient(mongoHost, 27017)[dbName]
+		collections = set(db.list_collection_names())
+		days = sorted(name[len('tickers_'):] for name in collections if re.fullmatch(r'tickers_\d{4}_\d{2}_\d{2}', name))
+		if date:
+			days = [day for day in days if day == datetime.datetime.strptime(date, '%Y-%m-%d').strftime('%Y_%m_%d')]
+		for day in days:
+			if not force and os.path.exists(os.path.join(directory, f'tickers_{day}.arrow')):
+				continue
+			# days crawled before the work queue have no queue to check
+			stats = WorkQueue(db, day).getStats() if 'queue_' + day in collections else {'inflight': 0, 'pending': 0}
+			if stats['inflight'] or stats['pending']:
+				print(f"Export | tickers_{day} skipped, {stats['inflight'] + stats['pending']} tickers are still to be crawled")
+				continue
+			Storage(dbName, mongoHost, day).export(directory)
 
 	def hitTicker(self, ticker):
 		crawler = Crawler()
 		pprint.pprint(crawler.crawlTicker(ticker))
+		HttpApi.printMessages()
 
 	def printFeedData(self, data):
 		feed = []
@@ -0,0 +1,138 @@
+#!/usr/bin/env -S python3 -u
+
+import pymongo
+import multiprocessing
+import argparse
+import hashlib
+import random
+import signal
+import time
+import os
+import crawler
+
+# Local harness of multi-node crawling: N crawler processes share one work queue in a local mongod,
+# tickers are synthetic so no external source is requested, and the result is compared with a single node run.
+
+class SimulatedTickerInfo(crawler.TickerInfo):
+
+	failureRate = 0.05
+	latency = 0.005
+
+	def __init__(self, tickerName, output = None):
+		self.tickerName = tickerName
+		self.output = output
+		self.skippedSections = []
+
+	def _simulateSource(self):
+		time.sleep(random.uniform(0, SimulatedTickerInfo.latency))
+		if random.random() < SimulatedTickerInfo.failureRate:
+			raise crawler.HostUnavailable('simulated outage')
+
+	def loadInternal(self):
+		self._simulateSource()
+		self.tickerId = int(hashlib.sha1(self.tickerName.encode()).hexdigest()[:8], 16)
+
+	def prefetch(self, sections = None):
+		pass
+
+	def _fill(self, section, info):
+		self._simulateSource()
+		if section == 'fillSettings':
+			info['_'] = {'webullIdentity': self.tickerId}
+		else:
+			info[section] = hashlib.sha1(f'{self.tickerName}.{section}'.encode()).hexdigest()
+
+for section in crawler.TickerInfo.sections:
+	setattr(SimulatedTickerInfo, section, lambda self, info, section = section: self._fill(section, info))
+
+
+class SimulatedCrawler(crawler.Crawler):
+
+	tickerInfoClass = SimulatedTickerInfo
+	tickers = 500
+
+	def enumerateTickers(self, token):
+		return [f'SIM{number}' for number in range(SimulatedCrawler.tickers)]
+
+	def prefetchMarket(self, tickers):
+		pass
+
+	def _printProgress(self, progress, total, tickerName, output):
+		pass
+
+
+def runNode(dbName, tickers, workers, failureRate):
+	# short leases let the surviving nodes take over the tickers of a killed one quickly
+	crawler.WorkQueue.leaseSeconds = 3
+	crawler.WorkQueue.heartbeatSeconds = 1
+	crawler.WorkQueue.retryDelay = 0.1
+	crawler.WorkQueue.maxAttempts = 100
+	SimulatedCrawler.tickers = tickers
+	SimulatedTickerInfo.failureRate = failureRate
+	signal.signal(signal.SIGTERM, lambda signum, frame: os._exit(1))
+	SimulatedCrawler(dbName).crawlTickersDaily(None, workers)
+
+
+class Simulation:
+
+	def __init__(self, nodes, tickers, workers, failureRate, killAfter):
+		self.nodes = nodes
+		self.tickers = tickers
+		self.workers = workers
+		self.failureRate = failureRate
+		self.killAfter = killAfter
+		self.context = multiprocessing.get_context('spawn')
+
+	def run(self, dbName, nodes):
+		pymongo.MongoClient('localhost', 27017).drop_database(dbName)
+		started = time.time()
+		processes = [self.context.Process(target=runNode, args=(dbName, self.tickers, self.workers, self.failureRate)) for _ in range(nodes)]
+		for process in processes:
+			process.start()
+		if self.killAfter is not None and nodes > 1:
+			time.sleep(self.killAfter)
+			processes[0].kill()
+			print(f"Simulation | node {processes[0].pid} killed after {self.killAfter}s")
+		for process in processes:
+			process.join()
+		print(f"Simulation | {dbName}: {nodes} nodes finished in {round(time.time() - started, 2)}s")
+
+	def getDocuments(self, dbName):
+		storage = crawler.Storage(dbName)
+		return {document['ticker']: document for document in storage.collection.find({}, {'_id': 0})}
+
+	def getQueueStats(self, dbName):
+		storage = crawler.Storage(dbName)
+		return crawler.WorkQueue(storage.db, storage.day).getStats()
+
+	def go(self):
+		self.run('webull_simulation_single', 1)
+		self.run('webull_simulation_nodes', self.nodes)
+		single = self.getDocuments('webull_simulation_single')
+		distributed = self.getDocuments('webull_simulation_nodes')
+		differ = [ticker for ticker in single if single[ticker] != distributed.get(ticker)]
+		print(f"Simulation | queue of single node: {self.getQueueStats('webull_simulation_single')}")
+		print(f"Simulation | queue of {self.nodes} nodes: {self.getQueueStats('webull_simulation_nodes')}")
+		print(f"Simulation | {len(single)} documents by single node, {len(distributed)} by {self.nodes} nodes, {len(differ)} differ")
+		return len(single) == self.tickers and not differ and len(single) == len(distributed)
+
+
+class UserInterface:
+
+	def __init__(self):
+		parser = argparse.ArgumentParser(description='Multi-node crawling simulation against local MongoDB')
+		parser.add_argument('--nodes', dest='nodes', type=int, default=3, help='Crawler processes sharing the queue')
+		parser.add_argument('--tickers', dest='tickers', type=int, default=500, help='Synthetic tickers')
+		parser.add_argument('--workers', dest='workers', type=int, default=4, help='Tickers crawled concurrently by each node')
+		parser.add_argument('--failure-rate', dest='failureRate', type=float, default=0.05, help='Probability of a simulated source outage per section')
+		parser.add_argument('--kill-after', dest='killAfter', type=float, default=None, help='Kill one node after N seconds')
+		self.args = parser.parse_args()
+
+	def go(self):
+		simulation = Simulation(self.args.nodes, self.args.tickers, self.args.workers, self.args.failureRate, self.args.killAfter)
+		if not simulation.go():
+			raise SystemExit('Simulation | multi-node result differs from single node')
+		print('Simulation | multi-node result is identical to single node')
+
+if __name__ == '__main__':
+	UserInterface().go()
@@ -0,0 +1,304 @@
+import datetime
+import numpy
+import pyarrow
+import pyarrow.ipc
+import tempfile
+import os
+
+# Columnar snapshot of a day of collected documents: a typed column per field path,
+# and arrays of documents (like options) as offsets into a nested snapshot of their elements.
+# Type codes follow the canonical BSON order, so missing, null and values of other types stay distinct.
+# A snapshot is stored as an Arrow IPC file, one file per day, with the columns of a field path named
+#   path#type (type codes), path#number (numbers, bools and dates), path#string (strings, when there are any)
+#   and path#elements (arrays of documents: a list of structs with the same columns and #document).
+
+MISSING, NULL, NUMBER, STRING, OBJECT, ARRAY, OTHER, BOOL, DATE = 0, 5, 10, 15, 20, 25, 35, 40, 45
+
+epoch = datetime.datetime(1970, 1, 1)
+
+def typeOf(value):
+	if value is None:
+		return NULL
+	if isinstance(value, bool):
+		return BOOL
+	if isinstance(value, (int, float)):
+		return NUMBER
+	if isinstance(value, str):
+		return STRING
+	if isinstance(value, dict):
+		return OBJECT
+	if isinstance(value, list):
+		return ARRAY
+	if isinstance(value, datetime.datetime):
+		return DATE
+	return OTHER
+
+def toNumber(value):
+	# numbers, bools and dates (milliseconds since epoch) share the numeric column
+	valueType = typeOf(value)
+	if valueType in (NUMBER, BOOL):
+		return float(value)
+	if valueType == DATE:
+		return (value.replace(tzinfo=None) - epoch) / datetime.timedelta(milliseconds=1)
+	return numpy.nan
+
+def resolve(document, path):
+	# arrays are not traversed, a path through one is missing
+	value = document
+	for key in path.split('.'):
+		if not isinstance(value, dict) or key not in value:
+			return Column.missing
+		value = value[key]
+	return value
+
+
+class Column:
+
+	missing = object()
+
+	def __init__(self, types, numbers, objects = None):
+		self.types = types
+		self.numbers = numbers
+		# values of strings, documents, arrays and other types, None when the column has none of them
+		self.objects = objects
+
+	def fromValues(values):
+		types = numpy.array([MISSING if value is Column.missing else typeOf(value) for value in values], dtype=numpy.uint8)
+		numbers = numpy.array([numpy.nan if value is Column.missing else toNumber(value) for value in values], dtype=numpy.float64)
+		objects = None
+		if numpy.isin(types, (STRING, OBJECT, ARRAY, OTHER)).any():
+			objects = numpy.empty(len(values), dtype=object)
+			objects[:] = [None if value is Column.missing else value for value in values]
+		return Column(types, numbers, objects)
+
+	def fromArrays(array, field, size):
+		# array(name) gives a stored column or None, a field without columns was missing in every document
+		types = array(field + '#type')
+		if types is None:
+			return Column(numpy.zeros(size, dtype=numpy.uint8), numpy.full(size, numpy.nan))
+		strings = array(field + '#string')
+		return Column(
+			types.to_numpy(zero_copy_only=True),
+			array(field + '#number').to_numpy(zero_copy_only=True),
+			strings.to_numpy(zero_copy_only=False) if strings is not None else None)
+
+	def toArrays(self, field):
+		arrays = {field + '#type': pyarrow.array(self.types), field + '#number': pyarrow.array(self.numbers)}
+		strings = self.types == STRING
+		if strings.any():
+			arrays[field + '#string'] = pyarrow.array(numpy.where(strings, self.objects, None), pyarrow.string())
+		return arrays
+
+	def __len__(self):
+		return len(self.types)
+
+	def value(self, row):
+		# the value back from its column, numbers come back as floats, documents and arrays as None
+		valueType = self.types[row]
+		if valueType == MISSING:
+			return Column.missing
+		if valueType == NUMBER:
+			return float(self.numbers[row])
+		if valueType == BOOL:
+			return bool(self.numbers[row])
+		if valueType == DATE:
+			return epoch + datetime.timedelta(milliseconds=float(self.numbers[row]))
+		if valueType == STRING or (valueType != NULL and self.objects is not None):
+			return self.objects[row]
+		return None
+
+	def exists(self):
+		return self.types != MISSING
+
+	def compare(self, operator, literal):
+		# query comparison: only values of the literal's type match, NaN matches nothing
+		literalType = typeOf(literal)
+		if literalType == NULL:
+			matches = numpy.isin(self.types, (NULL, MISSING))
+			return matches if operator in ('eq', 'gte', 'lte') else numpy.zeros(len(self), dtype=bool)
+		sameType = self.types == literalType
+		if literalType in (NUMBER, BOOL, DATE):
+			value = toNumber(literal)
+			with numpy.errstate(invalid='ignore'):
+				matches = {
+					'eq': self.numbers == value,
+					'gt': self.numbers > value,
+					'gte': self.numbers >= value,
+					'lt': self.numbers < value,
+					'lte': self.numbers <= value,
+				}[operator]
+			return sameType & matches
+		matches = numpy.zeros(len(self), dtype=bool)
+		for row in numpy.flatnonzero(sameType):
+			value = self.objects[row]
+			matches[row] = {'eq': value == literal, 'gt': value > literal, 'gte': value >= literal, 'lt': value < literal, 'lte': value <= literal}[operator]
+		return matches
+
+	def isIn(self, literals):
+		return numpy.logical_or.reduce([self.compare('eq', literal) for literal in literals] + [numpy.zeros(len(self), dtype=bool)])
+
+	def order(self, other):
+		# aggregation expression order: by type first, then by value, NaN below all numbers
+		order = numpy.sign(self.types.astype(numpy.int8) - other.types.astype(numpy.int8))
+		same = order == 0
+		numeric = same & numpy.isin(self.types, (NUMBER, BOOL, DATE))
+		leftNaN, rightNaN = numpy.isnan(self.numbers), numpy.isnan(other.numbers)
+		with numpy.errstate(invalid='ignore'):
+			values = numpy.where(leftNaN | rightNaN, rightNaN.astype(numpy.int8) - leftNaN.astype(numpy.int8), numpy.sign(self.numbers - other.numbers))
+		order[numeric] = values[numeric]
+		for row in numpy.flatnonzero(same & numpy.isin(self.types, (STRING, OBJECT, ARRAY, OTHER))):
+			left, right = self.objects[row], other.objects[row]
+			try:
+				order[row] = (left > right) - (left < right)
+			except TypeError:
+				order[row] = 0
+		return order
+
+	def subtract(self, other):
+		# numbers only, anything else gives null
+		numeric = (self.types == NUMBER) & (other.types == NUMBER)
+		types = numpy.where(numeric, NUMBER, NULL).astype(numpy.uint8)
+		numbers = numpy.where(numeric, self.numbers - other.numbers, numpy.nan)
+		return Column(types, numbers)
+
+
+class ListColumn:
+
+	def __init__(self, offsets, isDocument, elements):
+		# elements of row i are elements[offsets[i]:offsets[i+1]], only documents among them can match
+		self.offsets = offsets
+		self.isDocument = isDocument
+		self.elements = elements
+
+	def fromArrays(array, field, elementFields):
+		lists = array(field + '#elements')
+		if lists is None:
+			return ListColumn(numpy.zeros(1, dtype=numpy.int64), numpy.zeros(0, dtype=bool), Snapshot({}, {}, 0))
+		elements = lists.values
+		def elementArray(name):
+			index = elements.type.get_field_index(name)
+			return elements.field(index) if index >= 0 else None
+		return ListColumn(
+			lists.offsets.to_numpy().astype(numpy.int64),
+			elementArray('#document').to_numpy(zero_copy_only=False),
+			Snapshot.fromArrays(elementArray, len(elements), elementFields))
+
+	def toArrays(self, field):
+		elements = self.elements.toArrays()
+		elements['#document'] = pyarrow.array(self.isDocument)
+		structs = pyarrow.StructArray.from_arrays(list(elements.values()), list(elements.keys()))
+		return {field + '#elements': pyarrow.ListArray.from_arrays(pyarrow.array(self.offsets, pyarrow.int32()), structs)}
+
+	def any(self, matches):
+		counts = numpy.concatenate([[0], numpy.cumsum(matches & self.isDocument)])
+		return counts[self.offsets[1:]] > counts[self.offsets[:-1]]
+
+
+class Snapshot:
+
+	def __init__(self, columns, lists, size, values = {}):
+		self.columns = columns
+		self.lists = lists
+		self.size = size
+		# values of valueFields as they are in documents, for output rather than evaluation
+		self.values = values
+
+	def fromDocuments(documents, fields, listFields = {}, valueFields = ()):
+		# listFields maps a path of an array of documents to the paths read inside its elements
+		values = {field: [] for field in set(fields) | set(listFields) | set(valueFields)}
+		offsets = {field: [0] for field in listFields}
+		elements = {field: [] for field in listFields}
+		size = 0
+		for document in documents:
+			size += 1
+			for field, column in values.items():
+				column.append(resolve(document, field))
+			for field in listFields:
+				value = values[field][-1]
+				if isinstance(value, list):
+					elements[field].extend(value)
+				offsets[field].append(len(elements[field]))
+		columns = {field: Column.fromValues(values[field]) for field in set(fields) | set(listFields)}
+		lists = {}
+		for field, elementFields in listFields.items():
+			items = elements[field]
+			lists[field] = ListColumn(
+				numpy.array(offsets[field], dtype=numpy.int64),
+				numpy.array([isinstance(item, dict) for item in items], dtype=bool),
+				Snapshot.fromDocuments([item if isinstance(item, dict) else {} for item in items], elementFields))
+		return Snapshot(columns, lists, size, {field: values[field] for field in valueFields})
+
+	def fromArrays(array, size, fields, listFields = {}, valueFields = ()):
+		columns = {field: Column.fromArrays(array, field, size) for field in set(fields) | set(listFields) | set(valueFields)}
+		lists = {field: ListColumn.fromArrays(array, field, elementFields) for field, elementFields in listFields.items()}
+		return Snapshot(columns, lists, size)
+
+	def toArrays(self):
+		arrays = {}
+		for field, column in self.columns.items():
+			arrays.update(column.toArrays(field))
+		for field, elements in self.lists.items():
+			arrays.update(elements.toArrays(field))
+		return arrays
+
+	def __len__(self):
+		return self.size
+
+	def column(self, field):
+		return self.columns[field]
+
+	def list(self, field):
+		return self.lists[field]
+
+	def value(self, field, row, default = None):
+		value = self.values[field][row] if field in self.values else self.columns[field].value(row)
+		return default if value is Column.missing else value
+
+
+def paths(documents):
+	# every field path of the documents, documents on the way included, and the paths inside arrays of documents
+	fields, listFields = set(), {}
+	for document in documents:
+		_addPaths(document, '', fields, listFields)
+	fields.discard('_id')
+	return fields, listFields
+
+def _addPaths(document, prefix, fields, listFields):
+	for key, value in document.items():
+		path = prefix + key
+		fields.add(path)
+		if isinstance(value, dict):
+			_addPaths(value, path + '.', fields, listFields)
+		elif isinstance(value, list):
+			elementFields = listFields.setdefault(path, set())
+			for element in value:
+				if isinstance(element, dict):
+					_addPaths(element, '', elementFields, {})
+
+def export(documents, filename):
+	# the whole day with all of its field paths, replaced at once so readers never see a partial file
+	documents = list(documents)
+	table = pyarrow.table(Snapshot.fromDocuments(documents, *paths(documents)).toArrays())
+	table = table.replace_schema_metadata({'size': str(len(documents))})
+	# a temporary file of its own, several nodes may export the same day at once
+	descriptor, temporary = tempfile.mkstemp(prefix=os.path.basename(filename) + '.', suffix='.tmp', dir=os.path.dirname(filename) or '.')
+	os.close(descriptor)
+	try:
+		with pyarrow.OSFile(temporary, 'wb') as sink:
+			with pyarrow.ipc.new_file(sink, table.schema) as writer:
+				writer.write_table(table)
+		os.replace(temporary, filename)
+	except BaseException:
+		os.remove(temporary)
+		raise
+
+def load(filename, fields, listFields = {}, valueFields = ()):
+	# memory-mapped, only the columns of the requested fields are read
+	table = pyarrow.ipc.open_file(pyarrow.memory_map(filename)).read_all()
+	names = set(table.column_names)
+	def array(name):
+		if name not in names:
+			return None
+		chunks = table.column(name)
+		return chunks.chunk(0) if chunks.num_chunks == 1 else chunks.combine_chunks()
+	return Snapshot.fromArrays(array, int(table.schema.metadata[b'size']), fields, listFields, valueFields)
@@ -0,0 +1,37 @@
+import numpy as np
+import ai
+
+treats = [f'treat{bit}' for bit in range(8)]
+
+def saveHistory(historyFile, lastDay, final):
+	# pairs of every two days at least minDaysDiff apart, growth follows the first indicator
+	rows = {'masks': [], 'days_diff': [], 'growth_percent': [], 'day': []}
+	days = np.arange(1000, lastDay + 1)
+	for day in days:
+		for earlier in days[days <= day - ai.AI.minDaysDiff]:
+			masks = np.random.default_rng(int(day) * 10000 + int(earlier)).integers(0, 2 ** len(treats), 20, dtype=np.uint32)
+			rows['masks'].append(masks)
+			rows['days_diff'].append(np.full(len(masks), day - earlier, np.int32))
+			rows['growth_percent'].append(np.where(masks & 1, 10.0, 0.0))
+			rows['day'].append(np.full(len(masks), day, np.int32))
+	rows = {name: np.concatenate(values) for name, values in rows.items()}
+	dates = days if final else days[:-1]
+	np.savez(historyFile, treats=np.array(treats), min_days_diff=ai.AI.minDaysDiff, dates=dates.astype(np.int32), **rows)
+	return rows
+
+def test_update_fits_no_day_twice(tmp_path):
+	historyFile, modelFile = str(tmp_path / 'history.npz'), str(tmp_path / 'model.joblib')
+	# the latest day is not final yet, its pairs wait for it
+	rows = saveHistory(historyFile, 1060, False)
+	model = ai.AI.update(historyFile, modelFile=modelFile)
+	assert model.modelInfo['reason'] == 'no model'
+	assert model.trainedDays == list(range(1000, 1060))
+	assert model.modelInfo['features']['total'] == np.count_nonzero(rows['day'] < 1060)
+	# once final, the update fits the pairs of the latest day only
+	saveHistory(historyFile, 1060, True)
+	model = ai.AI.update(historyFile, modelFile=modelFile)
+	assert [update['pairs'] for update in model.modelInfo['updates']] == [np.count_nonzero(rows['day'] == 1060)]
+	assert model.trainedDays == list(range(1000, 1061))
+	# nothing new, nothing fitted
+	model = ai.AI.update(historyFile, modelFile=modelFile)
+	assert len(model.modelInfo['updates']) == 1